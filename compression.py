@@ -0,0 +1,221 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+'''
+Equivalence classes of tuples with the same preference signature (tuples
+equal on all attributes but the indifferent ones compare in the same way with
+any other tuple, so algorithms run over one tuple of each class)
+'''
+
+from array import array
+
+from rules import get_signature, parse_rules
+from sqlnative import get_preference_attributes
+
+# Column ordering the classes of best tuples when they are fetched again
+ORDER_COLUMN = 'cprefsql_order'
+
+# Column with the class of tuples equal on the signature attributes out of
+# the rules (projection)
+CLASS_COLUMN = 'cprefsql_class'
+
+# Type code for class columns (more classes than attribute values)
+CLASS_TYPE_CODE = 'l'
+
+# Temporary table with the class of each tuple of r (row id, attributes of
+# rules and class), computed once for each run
+CLASS_TABLE = 'cprefsql_classes'
+
+
+def get_preference_signature(pref_text, fieldnames):
+    '''
+    Return the signature attributes of a table for preferences
+    '''
+    return get_signature(fieldnames, parse_rules(pref_text))
+
+
+def get_projection(pref_text, signature):
+    '''
+    Split signature attributes into attributes of rules and attributes out of
+    the rules (only compared for equality, projected as a class column)
+    '''
+    attribute_list = get_preference_attributes(pref_text)
+    return [name for name in signature if name in attribute_list], \
+        [name for name in signature if name not in attribute_list]
+
+
+def get_projection_fields(rule_list, equal_list):
+    '''
+    Return the attributes of projected tuples (attributes of rules and class
+    column)
+    '''
+    if equal_list:
+        return rule_list + [CLASS_COLUMN]
+    return list(rule_list)
+
+
+def get_class_column(table, equal_list):
+    '''
+    Return the class of each row of a columnar table (rows equal on a list of
+    attributes have the same class)
+    '''
+    class_dict = {}
+    return array(CLASS_TYPE_CODE, [class_dict.setdefault(key, len(class_dict))
+                                   for key in table.rows(equal_list)])
+
+
+def compress_table(table, signature):
+    '''
+    Group rows of a columnar table by signature (signature values -> row
+    positions, classes in order of first row)
+    '''
+    class_dict = {}
+    for index, key in enumerate(table.rows(signature)):
+        if key in class_dict:
+            class_dict[key].append(index)
+        else:
+            class_dict[key] = [index]
+    return class_dict
+
+
+def get_representatives(class_dict):
+    '''
+    Return the position of the first row of each class
+    '''
+    return [index_list[0] for index_list in class_dict.values()]
+
+
+def expand_classes(best_list, class_dict, signature, topk=-1):
+    '''
+    Return the row positions of the classes of best records, in their order
+    (only the first topk rows when topk is not negative, best records must be
+    ordered by level)
+    '''
+    result_list = []
+    for rec in best_list:
+        result_list.extend(class_dict[tuple([rec[name]
+                                             for name in signature])])
+        if 0 <= topk <= len(result_list):
+            return result_list[:topk]
+    return result_list
+
+
+def sort_by_level(best_list, signature, best_function):
+    '''
+    Return TOP-k records ordered by level (records of the BEST of the list,
+    then of the BEST of the rest, ...), so classes of best records can be
+    truncated to k tuples (records with the same signature have the same
+    level)
+    '''
+    result_list = []
+    rest_list = list(best_list)
+    while rest_list:
+        key_set = set([tuple([rec[name] for name in signature])
+                       for rec in best_function(rest_list)])
+        level_list = [rec for rec in rest_list
+                      if tuple([rec[name] for name in signature]) in key_set]
+        if not level_list:
+            # Records left are kept in their order
+            result_list.extend(rest_list)
+            break
+        result_list.extend(level_list)
+        rest_list = [rec for rec in rest_list
+                     if tuple([rec[name] for name in signature])
+                     not in key_set]
+    return result_list
+
+
+def get_class_query(signature):
+    '''
+    Return the SQLite query fetching one tuple of each class
+    '''
+    return "SELECT * FROM r GROUP BY {s};".format(s=', '.join(signature))
+
+
+def get_class_table_query(rule_list, equal_list):
+    '''
+    Return the SQLite query creating the temporary table with the class of
+    each tuple of r (sorted once by attributes out of the rules)
+    '''
+    return "CREATE TEMP TABLE {t} AS SELECT rowid AS row_id, {r}, " \
+        "DENSE_RANK() OVER ( ORDER BY {e} ) AS {c} FROM r;".format(
+            t=CLASS_TABLE, r=', '.join(rule_list), e=', '.join(equal_list),
+            c=CLASS_COLUMN)
+
+
+def get_best_keys(best_list, signature):
+    '''
+    Return signature values of best records, in their order and without
+    repetition
+    '''
+    key_list = []
+    key_set = set()
+    for rec in best_list:
+        key = tuple([int(rec[name]) for name in signature])
+        if key not in key_set:
+            key_set.add(key)
+            key_list.append(key)
+    return key_list
+
+
+def select_classes(table, signature, best_list, topk=-1):
+    '''
+    Return positions of the rows of a columnar table with the signature of a
+    best record (projected or not), in the order of best records (only the
+    first topk rows when topk is not negative)
+    '''
+    order_dict = {key: order for order, key
+                  in enumerate(get_best_keys(best_list, signature))}
+    position_list = [[] for _ in order_dict]
+    for index, key in enumerate(table.rows(signature)):
+        order = order_dict.get(key)
+        if order is not None:
+            position_list[order].append(index)
+    result_list = []
+    for index_list in position_list:
+        result_list.extend(index_list)
+    if topk >= 0:
+        return result_list[:topk]
+    return result_list
+
+
+def get_projection_query(rule_list, equal_list, compress=False):
+    '''
+    Return the query fetching attributes of rules and the class column of all
+    tuples (one tuple of each class with compress), from the class table
+    when there are attributes out of the rules
+    '''
+    table = 'r'
+    if equal_list:
+        table = CLASS_TABLE
+    query = "SELECT {c} FROM {t};"
+    if compress:
+        query = "SELECT DISTINCT {c} FROM {t};"
+    return query.format(c=', '.join(get_projection_fields(rule_list,
+                                                          equal_list)),
+                        t=table)
+
+
+def get_expand_query(best_list, signature, topk=-1, equal_list=None):
+    '''
+    Return the query fetching tuples of the classes of best records, in
+    their order (None without best records). Projected records are matched
+    in the class table, then tuples are fetched by row id
+    '''
+    if not best_list:
+        return None
+    value_list = []
+    for order, key in enumerate(get_best_keys(best_list, signature)):
+        value_list.append('( {o}, {v} )'.format(
+            o=order, v=', '.join([str(value) for value in key])))
+    if equal_list:
+        query = "WITH w ( {o}, {s} ) AS ( VALUES {v} ) " \
+            "SELECT r.* FROM w JOIN {c} c USING ( {s} ) " \
+            "JOIN r ON r.rowid = c.row_id ORDER BY w.{o}"
+    else:
+        query = "WITH w ( {o}, {s} ) AS ( VALUES {v} ) " \
+            "SELECT r.* FROM w JOIN r USING ( {s} ) ORDER BY w.{o}"
+    query = query.format(o=ORDER_COLUMN, s=', '.join(signature),
+                         v=', '.join(value_list), c=CLASS_TABLE)
+    if topk >= 0:
+        query += " LIMIT {k}".format(k=topk)
+    return query + ";"
@@ -0,0 +1,342 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Running module for in-memory testing (no database, lower bound of the cost
+of preference algorithms)
+'''
+
+# Manager imports
+import os
+import sys
+import csv
+import time
+import resource
+
+import file_handler
+from compression import compress_table, expand_classes, \
+    get_class_column, get_preference_signature, get_projection, \
+    get_projection_fields, get_representatives, select_classes, \
+    sort_by_level
+from profiler import MemorySampler, PhaseTimer, MEMORY_INTERVAL, \
+    get_phase_fields, get_timeline_file, get_trace_file
+from table import ROW_COMPACT, ROW_DICT, ROW_FORMAT_LIST, Table
+
+# Required to relative package imports
+sys.path.append("/home/lucas/trabalho/cprefsql")
+
+from algorithms.partition import get_best_partition, get_topk_partition
+from algorithms.nested_loops import get_best, get_topk
+from algorithms.maxpref import get_mbest_partition, get_mtopk_partition
+
+# Algorithms for tuples comparison
+TUP_ALG_PARTITION = 'partition'
+TUP_ALG_BNL_STAR_STAR = 'bnl'
+TUP_ALG_MAX_PREF = 'maxpref'
+
+# List of algorithms for tuples
+TUP_ALG_LIST = [TUP_ALG_PARTITION, TUP_ALG_BNL_STAR_STAR, TUP_ALG_MAX_PREF]
+# Default algorithm for tuples
+TUP_DEFAULT_ALG = TUP_ALG_BNL_STAR_STAR
+
+# Preference files already read (file name -> text)
+PREFERENCE_CACHE = {}
+
+# Table already loaded (input file -> columnar table)
+TABLE_CACHE = {}
+
+# Load statistics stored in details file
+LOAD_FIELDS = ['load_time', 'load_rows', 'load_rows_per_sec', 'snapshot']
+# Load statistics of runs using data loaded by a previous run
+WARM_LOAD_STATS = {'load_time': 0, 'load_rows': 0, 'load_rows_per_sec': 0,
+                   'snapshot': 'warm'}
+
+# Phases of a run timed separately (stored as <phase>_time in details file)
+PHASE_LIST = ['parse', 'project', 'compress', 'materialize', 'preference',
+              'expand']
+
+# Peak memory of preference evaluation and of the whole run (over memory
+# before them, sampled)
+MEMORY_FIELDS = ['pref_memory', 'run_memory']
+
+# Number of classes of tuples with the same preference signature (compress)
+RUN_FIELDS = ['classes']
+
+
+def get_arguments(arg_list=None):
+    '''
+    Get arguments (from command line when arg_list is None)
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser('CPrefSQL')
+    parser.add_argument('-d', '--details', action='append', default=[],
+                        help='Append execution details to file (one '
+                        'measured run for each file)')
+    parser.add_argument('-i', '--input', default=None,
+                        help='CSV input file')
+    parser.add_argument('-r', '--rules', default=None,
+                        help='CPrefSQL rule file')
+    parser.add_argument('-a', '--algo', choices=TUP_ALG_LIST,
+                        default=TUP_DEFAULT_ALG,
+                        help='Preference algorithm')
+    parser.add_argument('-t', '--topk', default=-1,
+                        help='Number of TopK tupples')
+    parser.add_argument('-w', '--warmup', type=int, default=0,
+                        help='Number of runs before the measured ones')
+    parser.add_argument('-T', '--trace', action='store_true', default=False,
+                        help='Store phases of each run as a Chrome trace '
+                        'file next to its details file')
+    parser.add_argument('-R', '--rows', choices=ROW_FORMAT_LIST,
+                        default=ROW_DICT,
+                        help='Row representation given to the algorithm: a '
+                        'dictionary for each row (dict) or rows sharing '
+                        'the attribute positions (compact)')
+    parser.add_argument('-C', '--compress', action='store_true',
+                        default=False,
+                        help='Run the algorithm over one tuple of each class '
+                        'of tuples with the same preference signature '
+                        '(hashing), then expand the best classes')
+    parser.add_argument('-P', '--project', action='store_true',
+                        default=False,
+                        help='Give only attributes of rules and the class '
+                        'of the other signature attributes to the '
+                        'algorithm, then take whole rows of the best ones')
+    parser.add_argument('-m', '--memory-interval', type=float,
+                        default=MEMORY_INTERVAL,
+                        help='Seconds between memory samples of each run '
+                        '(0 disables sampling)')
+
+    args = parser.parse_args(arg_list)
+    return args
+
+
+def load_preferences(pref_filename):
+    '''
+    Read a preference file (kept in memory for next runs)
+    '''
+    if pref_filename not in PREFERENCE_CACHE:
+        pref_file = open(pref_filename)
+        PREFERENCE_CACHE[pref_filename] = pref_file.read()
+        pref_file.close()
+    return PREFERENCE_CACHE[pref_filename]
+
+
+def load_table(input_file, timer=None):
+    '''
+    Load the input file into a columnar table, returning the table and load
+    statistics (the table is loaded once for each process)
+    '''
+    if timer is None:
+        timer = PhaseTimer()
+    if input_file in TABLE_CACHE:
+        print("Table already loaded: ", input_file)
+        return TABLE_CACHE[input_file], WARM_LOAD_STATS.copy()
+
+    start_time = time.time()
+    with timer.phase('parse'):
+        # Binary column file is memory-mapped, CSV file is parsed
+        binary_filename = file_handler.get_binary_file(input_file)
+        if os.path.isfile(binary_filename):
+            table, _ = file_handler.read_binary_table(binary_filename)
+        else:
+            table = file_handler.read_csv_table(input_file)
+    load_time = time.time() - start_time
+
+    # Only one table is kept
+    TABLE_CACHE.clear()
+    TABLE_CACHE[input_file] = table
+    load_stats = {'load_time': round(load_time, 3),
+                  'load_rows': len(table),
+                  'load_rows_per_sec': round(len(table) /
+                                             max(load_time, 1e-9)),
+                  'snapshot': 'none'}
+    return table, load_stats
+
+
+def to_records(table, row_format=ROW_DICT):
+    '''
+    Convert rows of a columnar table into records given to the algorithm
+    '''
+    # Algorithms compare records as mappings of attributes
+    if row_format == ROW_COMPACT:
+        return list(table.row_views())
+    return list(table.records())
+
+
+def evaluate(table, pref_text, algorithm, topk, timer=None,
+             row_format=ROW_DICT, compress=False, run_stats=None,
+             project=False):
+    '''
+    Run a preference query over a columnar table, returning the best records
+    (with compress, over one row of each class of rows with the same
+    preference signature, with project, over attributes of rules and class,
+    returning all rows of the best classes)
+    '''
+    if timer is None:
+        timer = PhaseTimer()
+    if run_stats is None:
+        run_stats = {}
+
+    input_table = table
+    if compress or project:
+        signature = get_preference_signature(pref_text, table.fieldnames)
+    if project:
+        # Attributes out of the rules are replaced by the class of the row,
+        # other columns are shared, not copied
+        with timer.phase('project'):
+            rule_list, equal_list = get_projection(pref_text, signature)
+            column_list = [table.column(name) for name in rule_list]
+            if equal_list:
+                column_list.append(get_class_column(table, equal_list))
+            signature = get_projection_fields(rule_list, equal_list)
+            input_table = Table(signature, column_list)
+    if compress:
+        with timer.phase('compress'):
+            class_dict = compress_table(input_table, signature)
+            input_table = input_table.take(get_representatives(class_dict))
+        run_stats['classes'] = len(class_dict)
+
+    with timer.phase('materialize'):
+        rec_list = to_records(input_table, row_format)
+
+    with timer.phase('preference'):
+        if topk < 0:
+            # Run BEST algorithm
+            if algorithm == TUP_ALG_BNL_STAR_STAR:
+                BEST_LIST = get_best(pref_text, rec_list)
+            elif algorithm == TUP_ALG_PARTITION:
+                BEST_LIST = get_best_partition(pref_text, rec_list)
+            elif algorithm == TUP_ALG_MAX_PREF:
+                BEST_LIST = get_mbest_partition(pref_text, rec_list)
+        else:
+            # Run TOPK algorithm
+            if algorithm == TUP_ALG_BNL_STAR_STAR:
+                BEST_LIST = get_topk(pref_text, rec_list, topk)
+            elif algorithm == TUP_ALG_PARTITION:
+                BEST_LIST = get_topk_partition(pref_text, rec_list, topk)
+            elif algorithm == TUP_ALG_MAX_PREF:
+                BEST_LIST = get_mtopk_partition(pref_text, rec_list, topk)
+
+    if compress or project:
+        with timer.phase('expand'):
+            if topk >= 0:
+                # Classes are truncated to k rows in level order (any BEST
+                # algorithm finds the levels)
+                BEST_LIST = sort_by_level(
+                    BEST_LIST, signature,
+                    lambda best_list: get_best(pref_text, best_list))
+            if compress:
+                # Rows of the best classes
+                BEST_LIST = to_records(table.take(expand_classes(
+                    BEST_LIST, class_dict, signature, topk)), row_format)
+            else:
+                # Whole rows of the best ones (projected rows are in table
+                # order)
+                BEST_LIST = to_records(table.take(select_classes(
+                    input_table, signature, BEST_LIST, topk)), row_format)
+
+    return BEST_LIST
+
+
+def run(args):
+    '''
+    Run an experiment described by parsed arguments (importable entry point,
+    data and preferences stay loaded between calls in the same process)
+    '''
+    input_file = args.input
+    details_files = args.details
+    pref_filename = args.rules
+    algorithm = args.algo
+    topk = int(args.topk)
+
+    print("Parameters: ", input_file, " ", details_files, " ",
+          pref_filename, " ", algorithm, " ", topk)
+
+    load_timer = PhaseTimer()
+    table, load_stats = load_table(input_file, load_timer)
+
+    pref_text = load_preferences(pref_filename)
+
+    print('\n\nPreferences:')
+    print(pref_text)
+    print("Input entries loaded and ready!")
+
+    # Warm-up runs are not measured
+    for _ in range(args.warmup):
+        print("Running warm-up query...")
+        evaluate(table, pref_text, algorithm, topk, row_format=args.rows,
+                 compress=args.compress, project=args.project)
+
+    for details_file in details_files:
+        print("Running query...")
+        # Resident memory is sampled during the run
+        sampler = None
+        if args.memory_interval > 0:
+            sampler = MemorySampler([os.getpid()], args.memory_interval)
+            sampler.start()
+        timer = PhaseTimer(sampler)
+        # To measure run time
+        start_time = time.time()
+
+        run_stats = {}
+        BEST_LIST = evaluate(table, pref_text, algorithm, topk, timer,
+                             args.rows, args.compress, run_stats,
+                             args.project)
+
+        # To measure run time
+        end_time = time.time()
+        pref_mem = None
+        run_mem = None
+        if sampler is not None:
+            sampler.stop()
+            pref_mem = sampler.get_peak(0, *timer.get_span('preference'))
+            run_mem = sampler.get_run_peak(0)
+            sampler.write_timeline(get_timeline_file(details_file), ['rss'])
+        # Load phases are reported by the first run only (like load_stats)
+        timer.merge(load_timer)
+        load_timer = PhaseTimer()
+
+        mem = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss /
+                    1024.0, 3)
+        runtime = round(end_time - start_time, 3)
+
+        print("runtime: ", runtime)
+        print("memory: ", mem)
+        print("preference memory: ", pref_mem)
+        print("run memory: ", run_mem)
+        print('Best List size: ', len(BEST_LIST))
+
+        # Storing performance data
+        out_file = open(details_file, 'w')
+        out_write = csv.DictWriter(out_file, ['timestamp', 'runtime',
+                                              'memory', 'size'] +
+                                   LOAD_FIELDS +
+                                   get_phase_fields(PHASE_LIST) +
+                                   MEMORY_FIELDS + RUN_FIELDS)
+        out_write.writeheader()
+        rec = {'timestamp': time.time(), 'runtime': runtime, 'memory': mem,
+               'size': len(BEST_LIST), 'pref_memory': pref_mem,
+               'run_memory': run_mem}
+        rec.update(load_stats)
+        rec.update(run_stats)
+        rec.update(timer.get_fields(PHASE_LIST))
+        out_write.writerow(rec)
+        out_file.close()
+        if args.trace:
+            timer.write_trace(get_trace_file(details_file), 'memory')
+        # Next runs do not load data
+        load_stats = WARM_LOAD_STATS.copy()
+
+
+def main():
+    '''
+    Main CPrefSQL function
+    '''
+
+    # Get arguments
+    args = get_arguments()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
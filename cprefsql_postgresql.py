@@ -6,22 +6,38 @@ Main module
 
 # Manager imports
 import os
+import re
 import sys
 import csv
+import struct
+import uuid
+import zlib
 
 import psycopg2
 import psycopg2.extras
 
 import time
 
+import file_handler
+from compression import get_preference_signature, get_projection
+from sqlnative import get_create_index, \
+    get_index_list, get_index_name, get_native_query, is_index_name
+from profiler import MemorySampler, PhaseTimer, MEMORY_INTERVAL, \
+    get_phase_fields, get_timeline_file, get_trace_file
+from table import ROW_COMPACT, ROW_DICT, ROW_FORMAT_LIST, new_row_factory, \
+    numpy
+
 
 # Algorithms for tuples comparison
 TUP_ALG_PARTITION = 'partition'
 TUP_ALG_BNL_STAR_STAR = 'bnl'
 TUP_ALG_MAX_PREF = 'maxpref'
+# Preferences translated into SQL and evaluated by PostgreSQL
+TUP_ALG_SQL_NATIVE = 'sqlnative'
 
 # List of algorithms for tuples
-TUP_ALG_LIST = [TUP_ALG_PARTITION, TUP_ALG_BNL_STAR_STAR, TUP_ALG_MAX_PREF]
+TUP_ALG_LIST = [TUP_ALG_PARTITION, TUP_ALG_BNL_STAR_STAR, TUP_ALG_MAX_PREF,
+                TUP_ALG_SQL_NATIVE]
 # Default algorithm for tuples
 TUP_DEFAULT_ALG = TUP_ALG_BNL_STAR_STAR
 
@@ -37,6 +53,67 @@ DEFAULT_MAX_TIMESTAMP = 10
 # Default lines number to read from files
 DEFAULT_LINES_NUMBER_READ = 100000
 
+# Rows encoded at once for binary COPY
+COPY_BATCH_ROWS = 8192
+
+# Bytes read at once from data sent by COPY
+COPY_READ_SIZE = 1 << 20
+
+# Result retrieval modes: whole result sent with the query, or named cursor
+# on the server fetched in batches of tuples
+FETCH_ALL = 'all'
+FETCH_NAMED = 'named'
+FETCH_LIST = [FETCH_ALL, FETCH_NAMED]
+
+# Rows fetched at once from a named cursor (without --batch)
+FETCH_BATCH_ROWS = 10000
+
+# Load statistics stored in details file
+LOAD_FIELDS = ['load_time', 'load_rows', 'load_rows_per_sec', 'snapshot']
+# Load statistics of runs using data loaded by a previous run
+WARM_LOAD_STATS = {'load_time': 0, 'load_rows': 0, 'load_rows_per_sec': 0,
+                   'snapshot': 'warm'}
+
+# Phases of a run timed separately (stored as <phase>_time in details file),
+# query includes preference evaluation on server and transfer of the result,
+# with a named cursor the result is sent by first_row (time to first row
+# after query) and transfer (remaining rows)
+PHASE_LIST = ['build', 'index', 'connect', 'query', 'fetch', 'first_row',
+              'transfer']
+
+# Peak memory of the server process during the query and during the whole
+# run (over memory before them, sampled only when the server runs on this
+# machine, so runs on the same connection are measured apart)
+MEMORY_FIELDS = ['pref_memory', 'run_memory']
+
+# Statistics of preference functions measured by the server process (stored
+# in table cprefsql_stats by run ID, peak memory is also stored as memory)
+SERVER_FIELDS = ['run_id', 'server_cpu_user', 'server_cpu_system',
+                 'server_elapsed', 'server_input_rows', 'server_output_rows',
+                 'server_memory']
+
+# Settings of query sessions recorded in details file (storage
+# configuration), session settings are changed with --setting name=value
+# and reset otherwise, server settings only by restarting the server
+STORAGE_SETTINGS = ['work_mem', 'effective_cache_size', 'shared_buffers']
+SERVER_SETTINGS = ['shared_buffers']
+
+# Storage configuration: index on preference attributes and settings of
+# query sessions (name=value separated by ;)
+STORAGE_FIELDS = ['index', 'storage']
+
+# Preference files already read (file name -> text)
+PREFERENCE_CACHE = {}
+
+# Database already loaded ((input, unlogged, snapshot) -> snapshot schema)
+DATABASE_CACHE = {}
+
+# Connection kept open between runs (schema -> connection)
+CONNECTION_CACHE = {}
+
+# Statements prepared on the open connection (name -> function)
+PREPARED_CACHE = {}
+
 # PostgreSQL connecton variables
 host = "localhost"
 database = "trabalho"
@@ -44,68 +121,205 @@ user = "lion"
 password = "natani"
 
 
-def read_tuples_to_insert(filename):
-    if not os.path.isfile(filename):
-        print('File does not exists: ' + filename)
-        return ""
-
-    file_tuples = open(filename, 'r')
-    reader = csv.DictReader(file_tuples, skipinitialspace=True)
+class BinaryCopyReader:
+    '''
+    File-like object streaming a columnar table in PostgreSQL binary COPY
+    format (used by COPY ... FROM STDIN)
+    '''
 
-    recs = []
-    for rec in reader:
-        recs.append(rec)
+    def __init__(self, table):
+        self.table = table
+        # Next row to be encoded
+        self.position = 0
+        # Signature, flags and header extension length
+        self.buffer = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+        self.finished = False
+        field_number = len(table.fieldnames)
+        # Each row: fields number, then length and value of each field
+        self.row_struct = struct.Struct('>h' + 'ii' * field_number)
+        self.row_dtype = None
+        if numpy is not None:
+            dtype_list = [('count', '>i2')]
+            for index in range(field_number):
+                dtype_list.append(('length' + str(index), '>i4'))
+                dtype_list.append(('value' + str(index), '>i4'))
+            self.row_dtype = numpy.dtype(dtype_list)
+
+    def encode_rows(self, start, end):
+        '''
+        Encode rows of the table in binary COPY format
+        '''
+        field_number = len(self.table.fieldnames)
+        if self.row_dtype is not None:
+            rows = numpy.empty(end - start, dtype=self.row_dtype)
+            rows['count'] = field_number
+            for index, column in enumerate(self.table.columns):
+                rows['length' + str(index)] = 4
+                rows['value' + str(index)] = column[start:end]
+            return rows.tobytes()
+        column_list = [column[start:end] for column in self.table.columns]
+        encoded = []
+        for row in zip(*column_list):
+            values = [field_number]
+            for value in row:
+                values.append(4)
+                values.append(value)
+            encoded.append(self.row_struct.pack(*values))
+        return b''.join(encoded)
+
+    def read(self, size=-1):
+        '''
+        Return up to size bytes of the COPY stream
+        '''
+        rows_number = len(self.table)
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            if self.position < rows_number:
+                end = min(self.position + COPY_BATCH_ROWS, rows_number)
+                self.buffer += self.encode_rows(self.position, end)
+                self.position = end
+            else:
+                # File trailer
+                self.buffer += struct.pack('>h', -1)
+                self.finished = True
+        if size < 0:
+            size = len(self.buffer)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+
+def get_snapshot_schema(input_file, unlogged=False):
+    '''
+    Return the schema holding the database snapshot of an input file (table
+    options are part of the snapshot, so each one has its own schema)
+    '''
+    table_id = os.path.splitext(os.path.basename(input_file))[0]
+    if unlogged:
+        table_id += '_unlogged'
+    return 'snapshot_' + re.sub('[^a-z0-9_]', '_', table_id.lower())
 
-    return reader.fieldnames.copy(), recs
 
+def connect(schema=None):
+    '''
+    Connect to PostgreSQL, looking for tables and functions in the schema of
+    a snapshot first when a schema is given
+    '''
+    options = {}
+    if schema is not None:
+        options['options'] = '-c search_path={s},public'.format(s=schema)
+    return psycopg2.connect(host=host, database=database,
+                            user=user, password=password, **options)
 
-def build_database(fieldnames, datalist):
 
+def build_database(input_file, unlogged=False, snapshot=False):
+    '''
+    Load the input file into table r with COPY, returning load statistics.
+    With snapshot, table r lives in a schema for the input file and is only
+    loaded again when the content hash of the file changes
+    '''
     cleaner_query = "DROP TABLE IF EXISTS r CASCADE;"
-    create_query = "CREATE TABLE r ( {f} );"
-    insert_query = "INSERT INTO r VALUES \n{list};"
-
-    # create table
-    field_list = " , ".join([s + " INT " for s in fieldnames])
-    create_query = create_query.format(f=field_list)
-    print('CREATE QUERY: ', create_query)
-    datalist_values = []
-    for rec in datalist:
-        datalist_values.append("("+" , ".join(list(rec.values()))+")")
-    full_list = " ,\n".join(datalist_values)
-    insert_query = insert_query.format(list=full_list)
+    create_query = "CREATE {u} TABLE r ( {f} );"
+    snapshot_table_query = "CREATE TABLE IF NOT EXISTS " \
+        "public.cprefsql_snapshot ( name TEXT PRIMARY KEY, digest TEXT );"
+    snapshot_search_query = "SELECT digest FROM public.cprefsql_snapshot " \
+        "WHERE name = %s;"
+    snapshot_store_query = "INSERT INTO public.cprefsql_snapshot " \
+        "VALUES ( %s, %s ) ON CONFLICT ( name ) " \
+        "DO UPDATE SET digest = EXCLUDED.digest;"
+    schema_query = "DROP SCHEMA IF EXISTS {s} CASCADE; CREATE SCHEMA {s};"
+
+    # Binary column file is preferred to the CSV file
+    binary_filename = file_handler.get_binary_file(input_file)
+    if os.path.isfile(binary_filename):
+        data_filename = binary_filename
+    else:
+        data_filename = input_file
+
+    schema = None
+    digest = None
+    if snapshot:
+        schema = get_snapshot_schema(input_file, unlogged)
+        digest = file_handler.file_digest(data_filename)
 
     # load functions
     function_filename = "functions.sql"
     function_file = open(function_filename, "r")
     functions_query = function_file.read()
 
+    load_stats = {}
     conn = None
     try:
-        conn = psycopg2.connect(host=host, database=database,
-                                user=user, password=password)
-    except Error as e:
+        conn = connect(schema)
+    except psycopg2.Error as e:
         print(e)
 
     if conn is not None:
+        try:
+            cursor = conn.cursor()
+            if snapshot:
+                cursor.execute(snapshot_table_query)
+                cursor.execute(snapshot_search_query, (schema,))
+                row = cursor.fetchone()
+                if row is not None and row[0] == digest:
+                    print("Attaching to database snapshot: ", schema)
+                    # Functions are always reloaded into the snapshot schema
+                    cursor.execute(functions_query)
+                    conn.commit()
+                    conn.close()
+                    return {'load_time': 0, 'load_rows': 0,
+                            'load_rows_per_sec': 0, 'snapshot': 'hit'}
+                cursor.execute(schema_query.format(s=schema))
+        except psycopg2.Error as e:
+            print(e)
+            conn.close()
+            return load_stats
+
+        if data_filename == binary_filename:
+            table, _ = file_handler.read_binary_table(binary_filename)
+            fieldnames = table.fieldnames
+            copy_query = "COPY r FROM STDIN WITH (FORMAT binary);"
+            copy_source = BinaryCopyReader(table)
+        else:
+            copy_source = open(input_file, 'r')
+            fieldnames = next(csv.reader(copy_source, skipinitialspace=True))
+            copy_source.seek(0)
+            copy_query = "COPY r FROM STDIN WITH (FORMAT csv, HEADER true);"
+
+        # create table
+        field_list = " , ".join([s + " INT " for s in fieldnames])
+        create_query = create_query.format(u="UNLOGGED" if unlogged else "",
+                                           f=field_list)
+        print('CREATE QUERY: ', create_query)
         print("Constructing test database...")
 
         try:
-            cursor = conn.cursor()
             cursor.execute(cleaner_query)
-            conn.commit()
             cursor.execute(create_query)
-            conn.commit()
-            cursor.execute(insert_query)
-            conn.commit()
+            # Data is streamed from the file, no INSERT query is built
+            start_time = time.time()
+            cursor.copy_expert(copy_query, copy_source, size=COPY_READ_SIZE)
+            load_time = time.time() - start_time
+            rows_number = cursor.rowcount
             cursor.execute(functions_query)
+            if snapshot:
+                cursor.execute(snapshot_store_query, (schema, digest))
+            # Table, data and snapshot hash are committed together
             conn.commit()
+            load_stats = {'load_time': round(load_time, 3),
+                          'load_rows': rows_number,
+                          'load_rows_per_sec':
+                          round(rows_number / max(load_time, 1e-9)),
+                          'snapshot': 'miss' if snapshot else 'none'}
             print("Done!")
-        except Error as e:
+        except psycopg2.Error as e:
             print(e)
 
         conn.close()
 
+        if not isinstance(copy_source, BinaryCopyReader):
+            copy_source.close()
+    return load_stats
+
 
 def dump_database():
     search_query = "SELECT * FROM r;"
@@ -128,15 +342,16 @@ def dump_database():
         conn.close()
 
 
-def get_arguments():
+def get_arguments(arg_list=None):
     '''
-    Get arguments
+    Get arguments (from command line when arg_list is None)
     '''
     import argparse
 
     parser = argparse.ArgumentParser('CPrefSQL')
-    parser.add_argument('-d', '--details', default=None,
-                        help='Append execution details to file')
+    parser.add_argument('-d', '--details', action='append', default=[],
+                        help='Append execution details to file (one '
+                        'measured run for each file)')
     parser.add_argument('-i', '--input', default=None,
                         help='CSV input file')
     parser.add_argument('-r', '--rules', default=None,
@@ -146,112 +361,597 @@ def get_arguments():
                         help='Preference algorithm')
     parser.add_argument('-t', '--topk', default=-1,
                         help='Number of TopK tupples')
-    args = parser.parse_args()
+    parser.add_argument('-u', '--unlogged', action='store_true',
+                        default=False,
+                        help='Create table r as UNLOGGED')
+    parser.add_argument('-s', '--snapshot', action='store_true',
+                        default=False,
+                        help='Keep table r in a schema for the input file, '
+                        'reused while its content is the same')
+    parser.add_argument('-w', '--warmup', type=int, default=0,
+                        help='Number of runs before the measured ones')
+    parser.add_argument('-T', '--trace', action='store_true', default=False,
+                        help='Store phases of each run as a Chrome trace '
+                        'file next to its details file')
+    parser.add_argument('-b', '--batch', type=int, default=0,
+                        help='Read table r in batches of this size inside '
+                        'the preference function and stream its result, '
+                        'fetched in batches of this size from a named '
+                        'cursor (0 reads the whole table at once)')
+    parser.add_argument('-f', '--fetch', choices=FETCH_LIST,
+                        default=FETCH_ALL,
+                        help='Receive the whole result with the query '
+                        '(all) or fetch tuples in batches from a named '
+                        'cursor (named)')
+    parser.add_argument('-R', '--rows', choices=ROW_FORMAT_LIST,
+                        default=ROW_DICT,
+                        help='Row representation of the result (with --fetch '
+                        'all): a dictionary for each row (dict) or rows '
+                        'sharing the attribute positions (compact)')
+    parser.add_argument('-C', '--compress', action='store_true',
+                        default=False,
+                        help='Run the algorithm over one tuple of each class '
+                        'of tuples with the same preference signature '
+                        '(DISTINCT ON), then fetch tuples of the best '
+                        'classes')
+    parser.add_argument('-P', '--project', action='store_true',
+                        default=False,
+                        help='Run the algorithm over attributes of rules '
+                        'and the class of the other signature attributes '
+                        '(DENSE_RANK), then fetch whole tuples of the best '
+                        'ones')
+    parser.add_argument('-L', '--pushdown', action='store_true',
+                        default=False,
+                        help='With TOP-k, run the algorithm only over '
+                        'candidate tuples (levels up to the level of the '
+                        'k-th tuple, ranked by the server with ORDER BY ... '
+                        'LIMIT), without --compress and --project')
+    parser.add_argument('-S', '--setting', action='append', default=[],
+                        help='Setting of query sessions (name=value, e.g. '
+                        'work_mem or effective_cache_size)')
+    parser.add_argument('-I', '--index', action='store_true', default=False,
+                        help='Create an index on preference attributes '
+                        '(dropped without this option)')
+    parser.add_argument('-n', '--reconnect', action='store_true',
+                        default=False,
+                        help='Open a new connection for each run (server '
+                        'peak memory of each run apart from the others)')
+    parser.add_argument('-m', '--memory-interval', type=float,
+                        default=MEMORY_INTERVAL,
+                        help='Seconds between memory samples of each run '
+                        '(0 disables sampling)')
+    args = parser.parse_args(arg_list)
     return args
 
 
-def main():
+def load_preferences(pref_filename):
     '''
-    Main CPrefSQL function
+    Read a preference file (kept in memory for next runs)
     '''
+    if pref_filename not in PREFERENCE_CACHE:
+        pref_file = open(pref_filename)
+        PREFERENCE_CACHE[pref_filename] = pref_file.read()
+        pref_file.close()
+    return PREFERENCE_CACHE[pref_filename]
 
-    # command line
-    # python cprefsql_postgre.py -d detail.csv
-    #    -i input.csv -r pref.txt -a partition -t -1
 
-    # Get arguments
-    args = get_arguments()
+def evaluate_named(conn, call_query, param_list, timer=None, batch=0):
+    '''
+    Run a preference query through a named cursor on the server, returning
+    the best records as tuples
+    '''
+    if timer is None:
+        timer = PhaseTimer()
+    if batch <= 0:
+        batch = FETCH_BATCH_ROWS
+    cursor = conn.cursor(name='cprefsql_result')
+    with timer.phase('query'):
+        cursor.execute(call_query, param_list)
+    # Server evaluates the preference function for the first batch
+    with timer.phase('first_row'):
+        rec_list = cursor.fetchmany(batch)
+    with timer.phase('transfer'):
+        while True:
+            batch_list = cursor.fetchmany(batch)
+            if not batch_list:
+                break
+            rec_list.extend(batch_list)
+    cursor.close()
+    return rec_list
+
+
+def load_database(input_file, unlogged, snapshot, timer=None):
+    '''
+    Load the input file, returning the snapshot schema (None for public
+    table r) and load statistics (data is loaded once for each process)
+    '''
+    if timer is None:
+        timer = PhaseTimer()
+    key = (input_file, unlogged, snapshot)
+    if key in DATABASE_CACHE:
+        print("Database already loaded: ", input_file)
+        return DATABASE_CACHE[key], WARM_LOAD_STATS.copy()
+
+    # Functions are created again, statements are prepared again
+    close_connection()
+    with timer.phase('build'):
+        load_stats = build_database(input_file, unlogged, snapshot)
+    schema = None
+    if snapshot:
+        schema = get_snapshot_schema(input_file, unlogged)
+    # Only one database is kept (public table r is rebuilt for each input)
+    DATABASE_CACHE.clear()
+    DATABASE_CACHE[key] = schema
+    return schema, load_stats
+
+
+def get_query(algorithm, topk, batch=0):
+    '''
+    Return the preference function of an algorithm and the types of its
+    parameters (the streaming variant reading table r in batches when batch
+    is positive)
+    '''
+    if topk < 0:
+        # Run BEST algorithm
+        if algorithm == TUP_ALG_BNL_STAR_STAR:
+            func = "best_bnl"
+        elif algorithm == TUP_ALG_PARTITION:
+            func = "best_partition"
+        elif algorithm == TUP_ALG_MAX_PREF:
+            func = "best_maxpref"
+        type_list = ['text']
+    else:
+        # Run TOPK algorithm
+        if algorithm == TUP_ALG_BNL_STAR_STAR:
+            func = "topk_bnl"
+        elif algorithm == TUP_ALG_PARTITION:
+            func = "topk_partition"
+        elif algorithm == TUP_ALG_MAX_PREF:
+            func = "topk_maxpref"
+        type_list = ['text', 'integer']
 
-    input_file = args.input
-    details_file = args.details
-    pref_filename = args.rules
-    algorithm = args.algo
-    topk = int(args.topk)
+    if batch > 0:
+        func = func + "_stream"
+        type_list.append('integer')
 
-    print("Parameters: ", input_file, " ", details_file, " ",
-          pref_filename, " ", algorithm, " ", topk)
+    return func, type_list
 
-    fields, recs = read_tuples_to_insert(input_file)
-    build_database(fields, recs)
 
-    pref_file = open(pref_filename)
-    pref_text = pref_file.read()
+def get_query_parameters(pref_text, topk, batch=0):
+    '''
+    Return the values bound to the parameters of a preference function
+    '''
+    param_list = [pref_text]
+    if topk >= 0:
+        param_list.append(topk)
+    if batch > 0:
+        param_list.append(batch)
+    return param_list
 
-    query = ""
-    rec_list = []
 
-    print('\n\nPreferences:')
-    print(pref_text)
+def get_class_query(algorithm, topk, pref_text, signature, compress=True,
+                    project=False):
+    '''
+    Return the function running a preference function over one tuple of
+    each class of tuples with the same signature (over attributes of rules
+    and the class of the other signature attributes with project), the types
+    of its parameters and their values
+    '''
+    func, _ = get_query(algorithm, topk)
+    rule_list, _ = get_projection(pref_text, signature)
+    return 'preference_classes', ['text', 'text', 'integer', 'text[]',
+                                  'text[]', 'boolean', 'boolean'], \
+        [func, pref_text, topk, signature, rule_list, compress, project]
 
-    # Dump the database for debug
-    # dump_database()
 
-    print("Running query...")
+def get_candidate_function(algorithm, topk, pref_text):
+    '''
+    Return the function running a TOP-k preference function over candidate
+    tuples ranked by the server, the types of its parameters and their
+    values
+    '''
+    func, _ = get_query(algorithm, topk)
+    return 'preference_candidates', ['text', 'text', 'integer'], \
+        [func, pref_text, topk]
 
-    if topk < 0:
-        # Run BEST algorithm
 
-        basic_query = "SELECT * FROM {func}( '{pref}');"
+def get_fieldnames(conn):
+    '''
+    Return attributes of table r
+    '''
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM r LIMIT 0;")
+    fieldnames = [desc[0] for desc in cursor.description]
+    cursor.close()
+    return fieldnames
 
-        if algorithm == TUP_ALG_BNL_STAR_STAR:
-            basic_query = basic_query.format(func="best_bnl",
-                                             pref=pref_text)
-        elif algorithm == TUP_ALG_PARTITION:
-            basic_query = basic_query.format(func="best_partition",
-                                             pref=pref_text)
-        elif algorithm == TUP_ALG_MAX_PREF:
-            basic_query = basic_query.format(func="best_maxpref",
-                                             pref=pref_text)
 
-    else:
-        # Run TOPK algorithm
+def get_connection(schema, reconnect=False):
+    '''
+    Return the connection kept open between runs (a new one with reconnect)
+    '''
+    conn = CONNECTION_CACHE.get(schema)
+    if reconnect or conn is None or conn.closed:
+        close_connection()
+        conn = connect(schema)
+        CONNECTION_CACHE[schema] = conn
+    return conn
 
-        basic_query = "SELECT * FROM {func}( '{pref}', {topk} );"
 
-        if algorithm == TUP_ALG_BNL_STAR_STAR:
-            basic_query = basic_query.format(func="topk_bnl",
-                                             pref=pref_text, topk=topk)
-        elif algorithm == TUP_ALG_PARTITION:
-            basic_query = basic_query.format(func="topk_partition",
-                                             pref=pref_text, topk=topk)
-        elif algorithm == TUP_ALG_MAX_PREF:
-            basic_query = basic_query.format(func="topk_maxpref",
-                                             pref=pref_text, topk=topk)
+def close_connection():
+    '''
+    Close the connection kept open, forgetting its prepared statements
+    '''
+    for conn in CONNECTION_CACHE.values():
+        if not conn.closed:
+            conn.close()
+    CONNECTION_CACHE.clear()
+    PREPARED_CACHE.clear()
+
+
+def prepare_query(cursor, func, type_list):
+    '''
+    Prepare a statement calling a preference function on the server (once
+    for each connection), returning the query executing it
+    '''
+    prepare_query = "PREPARE {n} ( {t} ) AS SELECT * FROM {f}( {p} );"
+    execute_query = "EXECUTE {n} ( {p} );"
+
+    name = 'cprefsql_' + func
+    if name not in PREPARED_CACHE:
+        param_list = ['$' + str(index + 1)
+                      for index in range(len(type_list))]
+        cursor.execute(prepare_query.format(n=name, t=', '.join(type_list),
+                                            f=func,
+                                            p=', '.join(param_list)))
+        PREPARED_CACHE[name] = func
+    # Values are bound by psycopg2, so quotes in preferences are escaped
+    return execute_query.format(n=name, p=', '.join(['%s'] * len(type_list)))
+
+
+def prepare_native(cursor, query):
+    '''
+    Prepare a native query of preferences (once for each connection),
+    returning the query executing it
+    '''
+    # Name identifies the query (preferences and top-k)
+    name = 'cprefsql_native_{c:08x}'.format(c=zlib.crc32(query.encode()))
+    if name not in PREPARED_CACHE:
+        cursor.execute("PREPARE {n} AS {q}".format(n=name, q=query))
+        PREPARED_CACHE[name] = query
+    return "EXECUTE {n};".format(n=name)
+
+
+def get_settings(setting_list):
+    '''
+    Convert a list of name=value settings into a dictionary
+    '''
+    settings = {}
+    for setting in setting_list:
+        name, value = setting.split('=', 1)
+        settings[name.strip()] = value.strip()
+    return settings
+
+
+def apply_settings(conn, settings):
+    '''
+    Set settings of the session, resetting other session settings of the
+    storage configuration (left by previous runs on the same connection)
+    '''
+    cursor = conn.cursor()
+    for name in STORAGE_SETTINGS:
+        if name not in SERVER_SETTINGS and name not in settings:
+            cursor.execute("RESET {n};".format(n=name))
+    for name, value in settings.items():
+        cursor.execute("SET {n} = %s;".format(n=name), (value,))
+    cursor.close()
+
+
+def read_storage(conn):
+    '''
+    Return settings of the session as name=value separated by ;
+    '''
+    cursor = conn.cursor()
+    value_list = []
+    for name in STORAGE_SETTINGS:
+        cursor.execute("SHOW {n};".format(n=name))
+        value_list.append('{n}={v}'.format(n=name, v=cursor.fetchone()[0]))
+    cursor.close()
+    return ';'.join(value_list)
 
-    conn = psycopg2.connect(host=host,
-                            database=database, user=user, password=password)
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    # To measure run time
-    start_time = time.time()
+def set_indexes(conn, index_list):
+    '''
+    Create the indexes of a storage configuration (prefix and attributes),
+    dropping indexes of other configurations (runs on the server are not
+    made in parallel, so the snapshot schema is shared)
+    '''
+    name_list = [get_index_name(prefix, column_list)
+                 for prefix, column_list in index_list]
+    cursor = conn.cursor()
+    cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = "
+                   "current_schema() AND tablename = 'r';")
+    present_list = [name for (name,) in cursor.fetchall()]
+    for name in present_list:
+        if is_index_name(name) and name not in name_list:
+            cursor.execute("DROP INDEX {n};".format(n=name))
+    for name, (prefix, column_list) in zip(name_list, index_list):
+        if name not in present_list:
+            cursor.execute(get_create_index(prefix, column_list))
+    cursor.close()
+    conn.commit()
+
+
+def get_call_query(func, type_list):
+    '''
+    Return the query calling a preference function with bound values (named
+    cursors can not execute prepared statements)
+    '''
+    return "SELECT * FROM {f}( {p} );".format(
+        f=func, p=', '.join(['%s'] * len(type_list)))
+
 
-    cursor.execute(basic_query)
+def prepare_call(cursor, func, type_list, call_query):
+    '''
+    Prepare the query of a run, a preference function or a native query
+    when func is None, returning the query executing it
+    '''
+    if func is None:
+        return prepare_native(cursor, call_query)
+    return prepare_query(cursor, func, type_list)
+
+
+def set_run_id(cursor, run_id):
+    '''
+    Identify statistics stored by preference functions of this session
+    '''
+    cursor.execute("SELECT set_config('cprefsql.run_id', %s, false);",
+                   (run_id,))
+
+
+def read_server_stats(cursor, run_id):
+    '''
+    Return statistics stored by preference functions for a run ID
+    '''
+    stats_query = "SELECT input_rows, output_rows, cpu_user, cpu_system, " \
+        "elapsed, peak_memory FROM cprefsql_stats WHERE run_id = %s;"
+    cursor.execute(stats_query, (run_id,))
+    rec = cursor.fetchone()
+    if rec is None:
+        return {'run_id': run_id}
+    return {'run_id': run_id,
+            'server_cpu_user': round(rec['cpu_user'], 3),
+            'server_cpu_system': round(rec['cpu_system'], 3),
+            'server_elapsed': round(rec['elapsed'], 3),
+            'server_input_rows': rec['input_rows'],
+            'server_output_rows': rec['output_rows'],
+            'server_memory': round(rec['peak_memory'], 3)}
+
+
+def get_result_cursor(conn, row_format=ROW_DICT):
+    '''
+    Return a cursor receiving records as dictionaries or as tuples (compact
+    rows are built from tuples)
+    '''
+    if row_format == ROW_COMPACT:
+        return conn.cursor()
+    return conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+
+def evaluate(cursor, basic_query, param_list, timer=None,
+             row_format=ROW_DICT):
+    '''
+    Run a preference query, returning the best records
+    '''
+    if timer is None:
+        timer = PhaseTimer()
+    with timer.phase('query'):
+        cursor.execute(basic_query, param_list)
     rec_list = []
-    for rec in cursor.fetchall():
-        rec_list.append(rec)
+    with timer.phase('fetch'):
+        for rec in cursor.fetchall():
+            rec_list.append(rec)
+        if row_format == ROW_COMPACT:
+            # Attributes are shared by all rows
+            new_row = new_row_factory([desc[0]
+                                       for desc in cursor.description])
+            rec_list = list(map(new_row, rec_list))
+    return rec_list
 
-    # To measure run time
-    end_time = time.time()
 
-    # print('\n\nBest records:')
-    # for rec in rec_list:
-    #    print (rec)
+def run(args):
+    '''
+    Run an experiment described by parsed arguments (importable entry point,
+    data and preferences stay loaded between calls in the same process)
+    '''
+    try:
+        run_queries(args)
+    except psycopg2.Error:
+        # Connection kept open is aborted, next calls must not reuse it
+        close_connection()
+        raise
 
-    conn.close()
 
-    runtime = round(end_time - start_time, 3)
+def run_queries(args):
+    '''
+    Load data and preferences, then run warm-up and measured queries
+    '''
+
+    # command line
+    # python cprefsql_postgre.py -d detail.csv
+    #    -i input.csv -r pref.txt -a partition -t -1
 
-    print("runtime: ", runtime)
-    print("memory: ", 0)
-    print('Best List size: ', len(rec_list))
+    input_file = args.input
+    details_files = args.details
+    pref_filename = args.rules
+    algorithm = args.algo
+    topk = int(args.topk)
 
-    # Storing performance data
-    out_file = open(details_file, 'w')
-    out_write = csv.DictWriter(out_file, ['timestamp', 'runtime', 'memory'])
-    out_write.writeheader()
-    rec = {'timestamp': time.time(), 'runtime': runtime, 'memory': 0}
-    out_write.writerow(rec)
-    out_file.close()
+    print("Parameters: ", input_file, " ", details_files, " ",
+          pref_filename, " ", algorithm, " ", topk)
+
+    load_timer = PhaseTimer()
+    schema, load_stats = load_database(input_file, args.unlogged,
+                                       args.snapshot, load_timer)
+
+    pref_text = load_preferences(pref_filename)
+
+    print('\n\nPreferences:')
+    print(pref_text)
+
+    # Dump the database for debug
+    # dump_database()
+
+    # Indexes are created once, reported with load phases
+    settings = get_settings(args.setting)
+    conn = get_connection(schema)
+    native = algorithm == TUP_ALG_SQL_NATIVE or (args.pushdown and topk >= 0)
+    with load_timer.phase('index'):
+        set_indexes(conn, get_index_list(pref_text, get_fieldnames(conn),
+                                         args.index, native))
+    apply_settings(conn, settings)
+    storage_stats = {'index': int(args.index), 'storage': read_storage(conn)}
+
+    if algorithm == TUP_ALG_SQL_NATIVE:
+        # Preferences translated into SQL, without preference functions
+        func, type_list, param_list = None, [], None
+        call_query = get_native_query(pref_text, get_fieldnames(conn), topk)
+    elif args.pushdown and topk >= 0:
+        # Candidates of TOP-k ranked by the server
+        func, type_list, param_list = get_candidate_function(
+            algorithm, topk, pref_text)
+    elif args.compress or args.project:
+        # Classes of tuples with the same preference signature
+        signature = get_preference_signature(
+            pref_text, get_fieldnames(conn))
+        func, type_list, param_list = get_class_query(
+            algorithm, topk, pref_text, signature, args.compress,
+            args.project)
+    else:
+        func, type_list = get_query(algorithm, topk, args.batch)
+        param_list = get_query_parameters(pref_text, topk, args.batch)
+    if func is not None:
+        call_query = get_call_query(func, type_list)
+    # A client cursor receives the whole result with the query, streamed
+    # results are fetched in batches from a named cursor
+    fetch = args.fetch
+    if args.batch > 0:
+        fetch = FETCH_NAMED
+
+    # Warm-up runs are not measured
+    for _ in range(args.warmup):
+        print("Running warm-up query...")
+        conn = get_connection(schema, args.reconnect)
+        apply_settings(conn, settings)
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        if fetch == FETCH_NAMED:
+            evaluate_named(conn, call_query, param_list, batch=args.batch)
+        else:
+            basic_query = prepare_call(cursor, func, type_list, call_query)
+            evaluate(get_result_cursor(conn, args.rows), basic_query,
+                     param_list, row_format=args.rows)
+        conn.commit()
+
+    for details_file in details_files:
+        print("Running query...")
+        timer = PhaseTimer()
+
+        with timer.phase('connect'):
+            conn = get_connection(schema, args.reconnect)
+            apply_settings(conn, settings)
+            cursor = conn.cursor(
+                cursor_factory=psycopg2.extras.RealDictCursor)
+            run_id = uuid.uuid4().hex
+            set_run_id(cursor, run_id)
+            if fetch != FETCH_NAMED:
+                basic_query = prepare_call(cursor, func, type_list,
+                                           call_query)
+
+        # Resident memory of this process and its server process
+        sampler = None
+        if args.memory_interval > 0:
+            sampler = MemorySampler([os.getpid(), conn.get_backend_pid()],
+                                    args.memory_interval)
+            sampler.start()
+            timer.sampler = sampler
+
+        # To measure run time
+        start_time = time.time()
+
+        if fetch == FETCH_NAMED:
+            rec_list = evaluate_named(conn, call_query, param_list, timer,
+                                      args.batch)
+        else:
+            rec_list = evaluate(get_result_cursor(conn, args.rows),
+                                basic_query, param_list, timer, args.rows)
+
+        # To measure run time
+        end_time = time.time()
+        pref_mem = None
+        run_mem = None
+        if sampler is not None:
+            sampler.stop()
+            # Named cursors evaluate the function on the first fetch
+            pref_phase = 'first_row' if fetch == FETCH_NAMED else 'query'
+            pref_mem = sampler.get_peak(1, *timer.get_span(pref_phase))
+            run_mem = sampler.get_run_peak(1)
+            sampler.write_timeline(get_timeline_file(details_file),
+                                   ['rss', 'backend_rss'])
+        # Load phases are reported by the first run only (like load_stats)
+        timer.merge(load_timer)
+        load_timer = PhaseTimer()
+
+        # print('\n\nBest records:')
+        # for rec in rec_list:
+        #    print (rec)
+
+        # Statistics are kept on the server for later analysis
+        server_stats = read_server_stats(cursor, run_id)
+        conn.commit()
+        # Peak memory of the server process running the preference function
+        mem = server_stats.get('server_memory', 0)
+
+        runtime = round(end_time - start_time, 3)
+
+        print("runtime: ", runtime)
+        print("memory: ", mem)
+        print("preference memory: ", pref_mem)
+        print("run memory: ", run_mem)
+        print('Best List size: ', len(rec_list))
+
+        # Storing performance data
+        out_file = open(details_file, 'w')
+        out_write = csv.DictWriter(out_file, ['timestamp', 'runtime',
+                                              'memory', 'size'] +
+                                   LOAD_FIELDS +
+                                   get_phase_fields(PHASE_LIST) +
+                                   MEMORY_FIELDS + SERVER_FIELDS +
+                                   STORAGE_FIELDS)
+        out_write.writeheader()
+        rec = {'timestamp': time.time(), 'runtime': runtime, 'memory': mem,
+               'size': len(rec_list), 'pref_memory': pref_mem,
+               'run_memory': run_mem}
+        rec.update(load_stats)
+        rec.update(server_stats)
+        rec.update(storage_stats)
+        rec.update(timer.get_fields(PHASE_LIST))
+        out_write.writerow(rec)
+        out_file.close()
+        if args.trace:
+            timer.write_trace(get_trace_file(details_file), 'postgresql')
+        # Next runs do not load data
+        load_stats = WARM_LOAD_STATS.copy()
+
+
+def main():
+    '''
+    Main CPrefSQL function
+    '''
+
+    # Get arguments
+    args = get_arguments()
+    run(args)
+    close_connection()
 
 
 if __name__ == '__main__':
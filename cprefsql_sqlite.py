@@ -8,11 +8,23 @@ Running module for SQLite testing
 import os
 import sys
 import csv
+import itertools
 import sqlite3
 import time
 import psutil
 import resource
 
+import file_handler
+from compression import get_class_query, get_class_table_query, \
+    get_expand_query, get_preference_signature, get_projection, \
+    get_projection_fields, get_projection_query, sort_by_level
+from sqlnative import get_candidate_query, get_create_index, \
+    get_index_list, get_index_name, get_native_query, is_index_name
+from profiler import MemorySampler, PhaseTimer, MEMORY_INTERVAL, \
+    get_phase_fields, get_timeline_file, get_trace_file
+from table import Table, ROW_COMPACT, ROW_DICT, ROW_FORMAT_LIST, \
+    new_row_factory
+
 # Required to relative package imports
 sys.path.append("/home/lucas/trabalho/cprefsql")
 
@@ -24,11 +36,14 @@ from algorithms.maxpref import get_mbest_partition, get_mtopk_partition
 TUP_ALG_PARTITION = 'partition'
 TUP_ALG_BNL_STAR_STAR = 'bnl'
 TUP_ALG_MAX_PREF = 'maxpref'
+# Preferences translated into SQL and evaluated by SQLite
+TUP_ALG_SQL_NATIVE = 'sqlnative'
 
 DATA_FILE = "rdb.db"
 
 # List of algorithms for tuples
-TUP_ALG_LIST = [TUP_ALG_PARTITION, TUP_ALG_BNL_STAR_STAR, TUP_ALG_MAX_PREF]
+TUP_ALG_LIST = [TUP_ALG_PARTITION, TUP_ALG_BNL_STAR_STAR, TUP_ALG_MAX_PREF,
+                TUP_ALG_SQL_NATIVE]
 # Default algorithm for tuples
 TUP_DEFAULT_ALG = TUP_ALG_BNL_STAR_STAR
 
@@ -47,12 +62,61 @@ DEFAULT_LINES_NUMBER_READ = 100000
 # Default log file
 DEFAULT_LOG_FILE = 'cprefsqllog.log'
 
+# PRAGMAs applied while loading data (changed with --pragma name=value)
+LOAD_PRAGMAS = {'journal_mode': 'OFF',
+                'synchronous': 'OFF',
+                'cache_size': -262144}
+
+# PRAGMAs of query connections recorded in details file (storage
+# configuration, changed with --setting name=value)
+STORAGE_PRAGMAS = ['page_size', 'cache_size', 'mmap_size', 'journal_mode']
+
+# Preference files already read (file name -> text)
+PREFERENCE_CACHE = {}
+
+# Database already loaded ((input, snapshot, pragmas) -> file, statistics)
+DATABASE_CACHE = {}
+
+# Load statistics stored in details file
+LOAD_FIELDS = ['load_time', 'load_rows', 'load_rows_per_sec', 'load_memory',
+               'snapshot']
+# Load statistics of runs using data loaded by a previous run
+WARM_LOAD_STATS = {'load_time': 0, 'load_rows': 0, 'load_rows_per_sec': 0,
+                   'snapshot': 'warm'}
+
+# Phases of a run timed separately (stored as <phase>_time in details file)
+PHASE_LIST = ['parse', 'build', 'index', 'connect', 'fetch', 'materialize',
+              'preference', 'expand']
+
+# Peak memory of preference evaluation and of the whole run (over memory
+# before them, sampled)
+MEMORY_FIELDS = ['pref_memory', 'run_memory']
+
+# Number of classes of tuples with the same preference signature (compress)
+# and number of rows fetched for the algorithm
+RUN_FIELDS = ['classes', 'fetched_rows']
+
+# Storage configuration: index on preference attributes and PRAGMAs of
+# query connections (name=value separated by ;)
+STORAGE_FIELDS = ['index', 'storage']
+
+
+def read_tuples_to_insert(filename, row_format=ROW_DICT):
+    # Fast path: memory-map the binary column file stored alongside the CSV
+    binary_filename = file_handler.get_binary_file(filename)
+    if os.path.isfile(binary_filename):
+        table, _ = file_handler.read_binary_table(binary_filename)
+        return table.fieldnames.copy(), table
 
-def read_tuples_to_insert(filename):
     if not os.path.isfile(filename):
         print('File does not exists: ' + filename)
         return ""
 
+    if row_format == ROW_COMPACT:
+        # Columns of integers instead of a dictionary of strings for each row
+        table = file_handler.read_csv_table(filename)
+        return table.fieldnames.copy(), table
+
     file_tuples = open(filename, 'r')
     reader = csv.DictReader(file_tuples, skipinitialspace=True)
 
@@ -63,43 +127,157 @@ def read_tuples_to_insert(filename):
     return reader.fieldnames.copy(), recs
 
 
-def build_database(fieldnames, datalist):
-
+def build_database(fieldnames, datalist, pragmas=None, data_file=None,
+                   digest=None):
+    '''
+    Load records into table r, returning load statistics
+    '''
     cleaner_query = "DROP TABLE IF EXISTS r;"
     create_query = "CREATE TABLE r ( {f} );"
-    insert_query = "INSERT INTO r VALUES \n{list};"
+    insert_query = "INSERT INTO r VALUES ( {p} );"
 
     # create table
     field_list = " , ".join([s + " INT " for s in fieldnames])
     create_query = create_query.format(f=field_list)
-    datalist_values = []
-    for rec in datalist:
-        datalist_values.append("("+" , ".join(list(rec.values()))+")")
-    full_list = " ,\n".join(datalist_values)
-    insert_query = insert_query.format(list=full_list)
+    insert_query = insert_query.format(p=" , ".join(["?"] * len(fieldnames)))
+
+    # Rows are typed tuples (values of CSV files are converted to integers)
+    if isinstance(datalist, Table):
+        row_iter = datalist.rows()
+    else:
+        row_iter = (tuple([int(value) for value in rec.values()])
+                    for rec in datalist)
+
+    if pragmas is None:
+        pragmas = LOAD_PRAGMAS
+    if data_file is None:
+        data_file = DATA_FILE
 
+    load_stats = {}
     conn = None
     try:
-        conn = sqlite3.connect(DATA_FILE)
-    except Error as e:
+        # Transactions are handled explicitly
+        conn = sqlite3.connect(data_file, isolation_level=None)
+    except sqlite3.Error as e:
         print(e)
 
     if conn is not None:
         print("Constructing test database...")
         try:
             cursor = conn.cursor()
+            for name, value in pragmas.items():
+                cursor.execute("PRAGMA {n} = {v};".format(n=name, v=value))
+            start_time = time.time()
             cursor.execute(cleaner_query)
-            conn.commit()
             cursor.execute(create_query)
-            conn.commit()
-            cursor.execute(insert_query)
-            conn.commit()
+            # All chunks are inserted in a single transaction
+            cursor.execute("BEGIN;")
+            rows_number = 0
+            while True:
+                chunk = list(itertools.islice(row_iter,
+                                              DEFAULT_LINES_NUMBER_READ))
+                if not chunk:
+                    break
+                cursor.executemany(insert_query, chunk)
+                rows_number += len(chunk)
+            if digest is not None:
+                # Content hash of the input identifies the snapshot
+                cursor.execute("DROP TABLE IF EXISTS snapshot;")
+                cursor.execute("CREATE TABLE snapshot ( digest TEXT );")
+                cursor.execute("INSERT INTO snapshot VALUES ( ? );",
+                               (digest,))
+            cursor.execute("COMMIT;")
+            load_time = time.time() - start_time
+            load_stats = {'load_time': round(load_time, 3),
+                          'load_rows': rows_number,
+                          'load_rows_per_sec':
+                          round(rows_number / max(load_time, 1e-9)),
+                          'load_memory': round(resource.getrusage(
+                              resource.RUSAGE_SELF).ru_maxrss / 1024.0, 3)}
             print("Done!")
-        except Error as e:
+        except sqlite3.Error as e:
             print(e)
 
         conn.close()
 
+    return load_stats
+
+
+def get_snapshot_digest(data_file):
+    '''
+    Return the content hash stored in a database snapshot (None if absent)
+    '''
+    if not os.path.isfile(data_file):
+        return None
+    conn = sqlite3.connect(data_file)
+    try:
+        row = conn.execute("SELECT digest FROM snapshot;").fetchone()
+    except sqlite3.Error:
+        row = None
+    conn.close()
+    if row is None:
+        return None
+    return row[0]
+
+
+def open_snapshot(input_file, snapshot_dir, pragmas=None, timer=None,
+                  row_format=ROW_DICT, index_list=None):
+    '''
+    Return the database snapshot of an input file and load statistics,
+    building the snapshot only if its content hash does not match the input
+    (with the indexes of index_list)
+    '''
+    if index_list is None:
+        index_list = []
+    if timer is None:
+        timer = PhaseTimer()
+    # Hash of the file actually loaded (binary column file is preferred)
+    binary_filename = file_handler.get_binary_file(input_file)
+    if os.path.isfile(binary_filename):
+        digest = file_handler.file_digest(binary_filename)
+    else:
+        digest = file_handler.file_digest(input_file)
+
+    table_id = os.path.splitext(os.path.basename(input_file))[0]
+    # Snapshots built with another page size are kept apart
+    if pragmas is not None and 'page_size' in pragmas:
+        table_id += '.page' + str(pragmas['page_size'])
+    # Snapshots with other indexes are kept apart too, so indexes are not
+    # created or dropped while other runs (in parallel) use a snapshot
+    for prefix, column_list in index_list:
+        table_id += '.' + get_index_name(prefix, column_list)
+    data_file = os.path.join(snapshot_dir, table_id + '.db')
+    if get_snapshot_digest(data_file) == digest:
+        print("Attaching to database snapshot: ", data_file)
+        # Indexes left by older runs are dropped
+        with timer.phase('index'):
+            set_indexes(data_file, index_list)
+        return data_file, {'load_time': 0, 'load_rows': 0,
+                           'load_rows_per_sec': 0, 'snapshot': 'hit'}
+
+    # Build a new snapshot aside and replace the old one when complete
+    # (temporary file of each process, experiments may run in parallel)
+    temp_file = '{f}.{p}.tmp'.format(f=data_file, p=os.getpid())
+    if os.path.isfile(temp_file):
+        os.remove(temp_file)
+    with timer.phase('parse'):
+        fields, recs = read_tuples_to_insert(input_file, row_format)
+    with timer.phase('build'):
+        load_stats = build_database(fields, recs, pragmas, temp_file, digest)
+    if load_stats:
+        with timer.phase('index'):
+            if not set_indexes(temp_file, index_list):
+                load_stats = {}
+    if not load_stats:
+        # Snapshot in place is kept when the new one could not be built
+        print("Database snapshot not built: ", data_file)
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
+        return data_file, {'snapshot': 'failed'}
+    os.replace(temp_file, data_file)
+    load_stats['snapshot'] = 'miss'
+    return data_file, load_stats
+
 
 def dump_database():
     search_query = "SELECT * FROM r;"
@@ -123,15 +301,16 @@ def dump_database():
         conn.close()
 
 
-def get_arguments():
+def get_arguments(arg_list=None):
     '''
-    Get arguments
+    Get arguments (from command line when arg_list is None)
     '''
     import argparse
 
     parser = argparse.ArgumentParser('CPrefSQL')
-    parser.add_argument('-d', '--details', default=None,
-                        help='Append execution details to file')
+    parser.add_argument('-d', '--details', action='append', default=[],
+                        help='Append execution details to file (one '
+                        'measured run for each file)')
     parser.add_argument('-i', '--input', default=None,
                         help='CSV input file')
     parser.add_argument('-r', '--rules', default=None,
@@ -141,53 +320,299 @@ def get_arguments():
                         help='Preference algorithm')
     parser.add_argument('-t', '--topk', default=-1,
                         help='Number of TopK tupples')
-
-    args = parser.parse_args()
+    parser.add_argument('-p', '--pragma', action='append', default=[],
+                        help='SQLite PRAGMA used to load data (name=value)')
+    parser.add_argument('-S', '--setting', action='append', default=[],
+                        help='SQLite PRAGMA applied to each query connection '
+                        '(name=value, e.g. cache_size or mmap_size)')
+    parser.add_argument('-I', '--index', action='store_true', default=False,
+                        help='Create an index on preference attributes '
+                        '(dropped without this option)')
+    parser.add_argument('-s', '--snapshot', default=None,
+                        help='Directory of database snapshots (one for each '
+                        'input file, reused while its content is the same)')
+    parser.add_argument('-w', '--warmup', type=int, default=0,
+                        help='Number of runs before the measured ones')
+    parser.add_argument('-T', '--trace', action='store_true', default=False,
+                        help='Store phases of each run as a Chrome trace '
+                        'file next to its details file')
+    parser.add_argument('-R', '--rows', choices=ROW_FORMAT_LIST,
+                        default=ROW_DICT,
+                        help='Row representation given to the algorithm: a '
+                        'dictionary for each row (dict) or rows sharing '
+                        'the attribute positions (compact)')
+    parser.add_argument('-C', '--compress', action='store_true',
+                        default=False,
+                        help='Run the algorithm over one tuple of each class '
+                        'of tuples with the same preference signature '
+                        '(GROUP BY), then fetch tuples of the best classes')
+    parser.add_argument('-P', '--project', action='store_true',
+                        default=False,
+                        help='Fetch only attributes of rules and the class '
+                        'of the other signature attributes (DENSE_RANK) for '
+                        'the algorithm, then fetch whole tuples of the best '
+                        'ones')
+    parser.add_argument('-L', '--pushdown', action='store_true',
+                        default=False,
+                        help='With TOP-k, fetch only candidate tuples (levels '
+                        'up to the level of the k-th tuple, ranked by '
+                        'SQLite with ORDER BY ... LIMIT) for the algorithm '
+                        '(without --compress and --project)')
+    parser.add_argument('-m', '--memory-interval', type=float,
+                        default=MEMORY_INTERVAL,
+                        help='Seconds between memory samples of each run '
+                        '(0 disables sampling)')
+
+    args = parser.parse_args(arg_list)
     return args
 
 
-def main():
+def load_preferences(pref_filename):
     '''
-    Main CPrefSQL function
+    Read a preference file (kept in memory for next runs)
     '''
+    if pref_filename not in PREFERENCE_CACHE:
+        pref_file = open(pref_filename)
+        PREFERENCE_CACHE[pref_filename] = pref_file.read()
+        pref_file.close()
+    return PREFERENCE_CACHE[pref_filename]
 
-    # Get arguments
-    args = get_arguments()
 
-    input_file = args.input
-    details_file = args.details
-    pref_filename = args.rules
-    algorithm = args.algo
-    topk = int(args.topk)
+def load_database(input_file, snapshot_dir, pragmas, timer=None,
+                  row_format=ROW_DICT, index_list=None):
+    '''
+    Load the input file, returning database file and load statistics (the
+    database is loaded once for each process)
+    '''
+    if timer is None:
+        timer = PhaseTimer()
+    if index_list is None:
+        index_list = []
+    key = (input_file, snapshot_dir, tuple(sorted(pragmas.items())),
+           tuple([get_index_name(prefix, column_list)
+                  for prefix, column_list in index_list]))
+    if key in DATABASE_CACHE:
+        data_file, _ = DATABASE_CACHE[key]
+        print("Database already loaded: ", data_file)
+        return data_file, WARM_LOAD_STATS.copy()
+
+    if snapshot_dir is not None:
+        data_file, load_stats = open_snapshot(input_file, snapshot_dir,
+                                              pragmas, timer, row_format,
+                                              index_list)
+    else:
+        data_file = DATA_FILE
+        with timer.phase('parse'):
+            fields, recs = read_tuples_to_insert(input_file, row_format)
+        with timer.phase('build'):
+            load_stats = build_database(fields, recs, pragmas)
+        with timer.phase('index'):
+            set_indexes(data_file, index_list)
+        load_stats['snapshot'] = 'none'
+    # Only one database is kept (DATA_FILE is rebuilt for each input)
+    DATABASE_CACHE.clear()
+    DATABASE_CACHE[key] = (data_file, load_stats)
+    return data_file, load_stats
+
+
+def get_settings(setting_list):
+    '''
+    Convert a list of name=value settings into a dictionary
+    '''
+    settings = {}
+    for setting in setting_list:
+        name, value = setting.split('=', 1)
+        settings[name.strip()] = value.strip()
+    return settings
 
-    print("Parameters: ", input_file, " ", details_file, " ",
-          pref_filename, " ", algorithm, " ", topk)
 
-    fields, recs = read_tuples_to_insert(input_file)
-    build_database(fields, recs)
-    # dump_database()
+def open_connection(data_file, row_format=ROW_DICT, settings=None):
+    '''
+    Open a query connection to the database, applying PRAGMAs of settings
+    '''
+    CON = sqlite3.connect(data_file)
+    if row_format == ROW_DICT:
+        CON.row_factory = sqlite3.Row
+    if settings:
+        for name, value in settings.items():
+            CON.execute("PRAGMA {n} = {v};".format(n=name, v=value))
+    return CON
 
-    pref_file = open(pref_filename)
-    pref_text = pref_file.read()
 
-    print('\n\nPreferences:')
-    print(pref_text)
-    print("Input entries loaded and ready!")
+def read_storage(data_file, settings=None):
+    '''
+    Return PRAGMAs of a query connection as name=value separated by ;
+    '''
+    CON = open_connection(data_file, ROW_COMPACT, settings)
+    value_list = []
+    for name in STORAGE_PRAGMAS:
+        row = CON.execute("PRAGMA {n};".format(n=name)).fetchone()
+        value_list.append('{n}={v}'.format(
+            n=name, v='' if row is None else row[0]))
+    CON.close()
+    return ';'.join(value_list)
 
-    query = "SELECT * FROM r;"
-    rec_list = []
 
-    print("Running query...")
-    # To measure run time
-    start_time = time.time()
+def set_indexes(data_file, index_list):
+    '''
+    Create the indexes of a storage configuration (prefix and attributes),
+    dropping indexes of other configurations (the database is written only
+    when its indexes change), return False on error
+    '''
+    name_list = [get_index_name(prefix, column_list)
+                 for prefix, column_list in index_list]
+    conn = sqlite3.connect(data_file)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index';")
+        present_list = [name for (name,) in cursor.fetchall()]
+        for name in present_list:
+            if is_index_name(name) and name not in name_list:
+                cursor.execute("DROP INDEX {n};".format(n=name))
+        for name, (prefix, column_list) in zip(name_list, index_list):
+            if name not in present_list:
+                cursor.execute(get_create_index(prefix, column_list))
+        conn.commit()
+    except sqlite3.Error as e:
+        print(e)
+        return False
+    finally:
+        conn.close()
+    return True
+
+
+def read_fieldnames(input_file):
+    '''
+    Return the attributes of an input file (from the binary column file when
+    it exists)
+    '''
+    binary_filename = file_handler.get_binary_file(input_file)
+    if os.path.isfile(binary_filename):
+        table, _ = file_handler.read_binary_table(binary_filename)
+        return table.fieldnames.copy()
+    with open(input_file, 'r') as file_tuples:
+        return next(csv.reader(file_tuples, skipinitialspace=True))
+
 
-    CON = sqlite3.connect(DATA_FILE)
-    CON.row_factory = sqlite3.Row
-    CURSOR = CON.cursor()
-    CURSOR.execute(query)
-    for rec in CURSOR.fetchall():
-        rec_list.append(dict(rec))
+def to_records(cursor, row_list, row_format=ROW_DICT):
+    '''
+    Convert rows fetched by a cursor into records given to the algorithm
+    '''
+    if row_format == ROW_COMPACT:
+        # Tuples fetched are kept, attributes are shared by all rows
+        new_row = new_row_factory([desc[0] for desc in cursor.description])
+        return list(map(new_row, row_list))
+    return [dict(rec) for rec in row_list]
 
+
+def evaluate_native(data_file, pref_text, topk, timer=None,
+                    row_format=ROW_DICT, run_stats=None, settings=None):
+    '''
+    Run a preference query translated into SQL, returning the best records
+    (preferences are evaluated by SQLite while the result is fetched)
+    '''
+    if timer is None:
+        timer = PhaseTimer()
+    if run_stats is None:
+        run_stats = {}
+
+    with timer.phase('connect'):
+        CON = open_connection(data_file, row_format, settings)
+        CURSOR = CON.cursor()
+        CURSOR.execute("SELECT * FROM r LIMIT 0;")
+        query = get_native_query(
+            pref_text, [desc[0] for desc in CURSOR.description], topk)
+    with timer.phase('preference'):
+        CURSOR.execute(query)
+        row_list = CURSOR.fetchall()
+    run_stats['fetched_rows'] = len(row_list)
+    with timer.phase('materialize'):
+        BEST_LIST = to_records(CURSOR, row_list, row_format)
+    CON.close()
+    return BEST_LIST
+
+
+def evaluate(data_file, pref_text, algorithm, topk, timer=None,
+             row_format=ROW_DICT, compress=False, run_stats=None,
+             project=False, pushdown=False, settings=None):
+    '''
+    Run a preference query over table r, returning the best records (with
+    compress, over one tuple of each class of tuples with the same
+    preference signature, with project, over attributes of rules and class,
+    returning all tuples of the best classes, with pushdown, over TOP-k
+    candidates ranked by SQLite)
+    '''
+    if algorithm == TUP_ALG_SQL_NATIVE:
+        return evaluate_native(data_file, pref_text, topk, timer, row_format,
+                               run_stats, settings)
+    # Candidates are whole tuples
+    pushdown = pushdown and topk >= 0
+    if pushdown:
+        compress = project = False
+
+    query = "SELECT * FROM r;"
+    if timer is None:
+        timer = PhaseTimer()
+    if run_stats is None:
+        run_stats = {}
+
+    with timer.phase('connect'):
+        CON = open_connection(data_file, row_format, settings)
+        CURSOR = CON.cursor()
+        if pushdown:
+            CURSOR.execute("SELECT * FROM r LIMIT 0;")
+            query = get_candidate_query(
+                pref_text, [desc[0] for desc in CURSOR.description], topk)
+        if compress or project:
+            CURSOR.execute("SELECT * FROM r LIMIT 0;")
+            signature = get_preference_signature(
+                pref_text, [desc[0] for desc in CURSOR.description])
+            equal_list = []
+            if project:
+                # Attributes out of the rules are replaced by their class
+                rule_list, equal_list = get_projection(pref_text, signature)
+                if equal_list:
+                    CURSOR.execute(get_class_table_query(rule_list,
+                                                         equal_list))
+                query = get_projection_query(rule_list, equal_list, compress)
+                signature = get_projection_fields(rule_list, equal_list)
+            else:
+                query = get_class_query(signature)
+    with timer.phase('fetch'):
+        CURSOR.execute(query)
+        row_list = CURSOR.fetchall()
+    run_stats['fetched_rows'] = len(row_list)
+    with timer.phase('materialize'):
+        rec_list = to_records(CURSOR, row_list, row_format)
+    if compress:
+        run_stats['classes'] = len(rec_list)
+
+    with timer.phase('preference'):
+        BEST_LIST = evaluate_preference(pref_text, rec_list, algorithm, topk)
+
+    if compress or project:
+        # Tuples of the best classes
+        with timer.phase('expand'):
+            if topk >= 0:
+                # Classes are truncated to k tuples in level order (any BEST
+                # algorithm finds the levels)
+                BEST_LIST = sort_by_level(
+                    BEST_LIST, signature,
+                    lambda best_list: get_best(pref_text, best_list))
+            expand_query = get_expand_query(BEST_LIST, signature, topk,
+                                            equal_list)
+            BEST_LIST = []
+            if expand_query is not None:
+                CURSOR.execute(expand_query)
+                BEST_LIST = to_records(CURSOR, CURSOR.fetchall(), row_format)
+    CON.close()
+    return BEST_LIST
+
+
+def evaluate_preference(pref_text, rec_list, algorithm, topk):
+    '''
+    Run the preference algorithm over a list of records
+    '''
     if topk < 0:
         # Run BEST algorithm
         if algorithm == TUP_ALG_BNL_STAR_STAR:
@@ -205,27 +630,127 @@ def main():
         elif algorithm == TUP_ALG_MAX_PREF:
             BEST_LIST = get_mtopk_partition(pref_text, rec_list, topk)
 
-    # To measure run time
-    end_time = time.time()
-
-    # to get memory
-    # must change by OS, on UNIX uses "resource" library
-    # process = psutil.Process(os.getpid())
-    # mem = round(process.memory_info().peak_wset / 1024.0 / 1024.0, 3)
-    mem = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 3)
-    runtime = round(end_time - start_time, 3)
-
-    print("runtime: ", runtime)
-    print("memory: ", mem)
-    print('Best List size: ', len(BEST_LIST))
-
-    # Storing performance data
-    out_file = open(details_file, 'w')
-    out_write = csv.DictWriter(out_file, ['timestamp', 'runtime', 'memory'])
-    out_write.writeheader()
-    rec = {'timestamp': time.time(), 'runtime': runtime, 'memory': mem}
-    out_write.writerow(rec)
-    out_file.close()
+    return BEST_LIST
+
+
+def run(args):
+    '''
+    Run an experiment described by parsed arguments (importable entry point,
+    data and preferences stay loaded between calls in the same process)
+    '''
+    input_file = args.input
+    details_files = args.details
+    pref_filename = args.rules
+    algorithm = args.algo
+    topk = int(args.topk)
+
+    print("Parameters: ", input_file, " ", details_files, " ",
+          pref_filename, " ", algorithm, " ", topk)
+
+    pragmas = LOAD_PRAGMAS.copy()
+    pragmas.update(get_settings(args.pragma))
+    settings = get_settings(args.setting)
+
+    pref_text = load_preferences(pref_filename)
+
+    print('\n\nPreferences:')
+    print(pref_text)
+
+    # Indexes are created with the database, reported with load phases
+    native = algorithm == TUP_ALG_SQL_NATIVE or (args.pushdown and topk >= 0)
+    index_list = get_index_list(pref_text, read_fieldnames(input_file),
+                                args.index, native)
+    load_timer = PhaseTimer()
+    data_file, load_stats = load_database(input_file, args.snapshot, pragmas,
+                                          load_timer, args.rows, index_list)
+    # dump_database()
+    print("Input entries loaded and ready!")
+
+    storage_stats = {'index': int(args.index),
+                     'storage': read_storage(data_file, settings)}
+
+    # Warm-up runs are not measured
+    for _ in range(args.warmup):
+        print("Running warm-up query...")
+        evaluate(data_file, pref_text, algorithm, topk, row_format=args.rows,
+                 compress=args.compress, project=args.project,
+                 pushdown=args.pushdown, settings=settings)
+
+    for details_file in details_files:
+        print("Running query...")
+        # Resident memory is sampled during the run
+        sampler = None
+        if args.memory_interval > 0:
+            sampler = MemorySampler([os.getpid()], args.memory_interval)
+            sampler.start()
+        timer = PhaseTimer(sampler)
+        # To measure run time
+        start_time = time.time()
+
+        run_stats = {}
+        BEST_LIST = evaluate(data_file, pref_text, algorithm, topk, timer,
+                             args.rows, args.compress, run_stats,
+                             args.project, args.pushdown, settings)
+
+        # To measure run time
+        end_time = time.time()
+        pref_mem = None
+        run_mem = None
+        if sampler is not None:
+            sampler.stop()
+            pref_mem = sampler.get_peak(0, *timer.get_span('preference'))
+            run_mem = sampler.get_run_peak(0)
+            sampler.write_timeline(get_timeline_file(details_file), ['rss'])
+        # Load phases are reported by the first run only (like load_stats)
+        timer.merge(load_timer)
+        load_timer = PhaseTimer()
+
+        # to get memory
+        # must change by OS, on UNIX uses "resource" library
+        # process = psutil.Process(os.getpid())
+        # mem = round(process.memory_info().peak_wset / 1024.0 / 1024.0, 3)
+        mem = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss /
+                    1024.0, 3)
+        runtime = round(end_time - start_time, 3)
+
+        print("runtime: ", runtime)
+        print("memory: ", mem)
+        print("preference memory: ", pref_mem)
+        print("run memory: ", run_mem)
+        print('Best List size: ', len(BEST_LIST))
+
+        # Storing performance data
+        out_file = open(details_file, 'w')
+        out_write = csv.DictWriter(out_file, ['timestamp', 'runtime',
+                                              'memory', 'size'] +
+                                   LOAD_FIELDS +
+                                   get_phase_fields(PHASE_LIST) +
+                                   MEMORY_FIELDS + RUN_FIELDS +
+                                   STORAGE_FIELDS)
+        out_write.writeheader()
+        rec = {'timestamp': time.time(), 'runtime': runtime, 'memory': mem,
+               'size': len(BEST_LIST), 'pref_memory': pref_mem,
+               'run_memory': run_mem}
+        rec.update(load_stats)
+        rec.update(run_stats)
+        rec.update(storage_stats)
+        rec.update(timer.get_fields(PHASE_LIST))
+        out_write.writerow(rec)
+        out_file.close()
+        if args.trace:
+            timer.write_trace(get_trace_file(details_file), 'sqlite')
+        # Next runs do not load data
+        load_stats = WARM_LOAD_STATS.copy()
+
+
+def main():
+    '''
+    Main CPrefSQL function
+    '''
+
+    # Get arguments
+    args = get_arguments()
+    run(args)
 
 
 if __name__ == '__main__':
@@ -5,7 +5,23 @@ File and Directory handling
 '''
 
 import csv
+import hashlib
+import io
+import itertools
+import json
+import mmap
 import os
+import struct
+import time
+from array import array
+
+from table import Table, TYPE_CODE, new_column, numpy
+
+# Binary column format: magic, header length, JSON header (schema, rows
+# number, seed...) padded to 8 bytes, then one array of bytes per column
+BINARY_EXTENSION = '.col'
+BINARY_MAGIC = b'CPREFCOL'
+BINARY_VERSION = 1
 
 # =============================================================================
 # Generic directories and files
@@ -22,20 +38,237 @@ def create_directory(directory):
 
 def write_to_csv(filename, attribute_list, record_list):
     '''
-    Store record list into a CSV file
+    Store record list (or columnar table) into a CSV file
     '''
     print("writing csv data...")
     # Check if file does not exists
     if not os.path.isfile(filename):
         # Store data to file
         data_file = open(filename, 'w')
-        writer = csv.DictWriter(data_file, attribute_list, delimiter=',',
+        if isinstance(record_list, Table):
+            # Columnar tables are written row by row without dictionaries
+            writer = csv.writer(data_file, delimiter=',',
                                 lineterminator='\n')
-        writer.writeheader()
-        writer.writerows(record_list)
+            writer.writerow(attribute_list)
+            writer.writerows(record_list.rows(attribute_list))
+        else:
+            writer = csv.DictWriter(data_file, attribute_list, delimiter=',',
+                                    lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(record_list)
         data_file.close()
 
 
+def format_csv_chunk(chunk, attribute_list):
+    '''
+    Format a chunk of a columnar table as CSV text (without header)
+    '''
+    text = io.StringIO()
+    writer = csv.writer(text, delimiter=',', lineterminator='\n')
+    writer.writerows(chunk.rows(attribute_list))
+    return text.getvalue()
+
+
+def write_csv_parts(filename, attribute_list, part_list):
+    '''
+    Stream parts of CSV text, given as (rows number, text) pairs, into a file
+    '''
+    print("writing csv data...")
+    # Check if file does not exists
+    if os.path.isfile(filename):
+        return 0
+    # Write to a temporary file so interrupted runs leave no partial data
+    temp_filename = filename + '.tmp'
+    start_time = time.time()
+    rows_number = 0
+    data_file = open(temp_filename, 'w')
+    data_file.write(','.join(attribute_list) + '\n')
+    # Only one part is kept in memory at a time
+    for part_rows, part_text in part_list:
+        data_file.write(part_text)
+        rows_number += part_rows
+    data_file.close()
+    os.replace(temp_filename, filename)
+    # Report writing throughput
+    elapsed = max(time.time() - start_time, 1e-9)
+    print("rows written: ", rows_number, " (",
+          round(rows_number / elapsed), " rows/sec)")
+    return rows_number
+
+
+def write_chunks_to_csv(filename, attribute_list, chunk_list):
+    '''
+    Stream chunks of a columnar table into a CSV file
+    '''
+    part_list = ((len(chunk), format_csv_chunk(chunk, attribute_list))
+                 for chunk in chunk_list)
+    return write_csv_parts(filename, attribute_list, part_list)
+
+
+def copy_csv_prefix(source_filename, filename, rows_number):
+    '''
+    Store the header and the first rows of a CSV file into another file
+    '''
+    print("writing csv data (prefix of " + source_filename + ")...")
+    # Check if file does not exists
+    if os.path.isfile(filename):
+        return 0
+    temp_filename = filename + '.tmp'
+    source_file = open(source_filename, 'r')
+    data_file = open(temp_filename, 'w')
+    data_file.writelines(itertools.islice(source_file, rows_number + 1))
+    data_file.close()
+    source_file.close()
+    os.replace(temp_filename, filename)
+    return rows_number
+
+
+def get_binary_file(filename):
+    '''
+    Return the binary column file stored alongside a CSV file
+    '''
+    return os.path.splitext(filename)[0] + BINARY_EXTENSION
+
+
+def encode_binary_header(header):
+    '''
+    Encode the header of a binary column file
+    '''
+    header_text = json.dumps(header, sort_keys=True).encode('utf-8')
+    header_bytes = BINARY_MAGIC + struct.pack('<I', len(header_text)) + \
+        header_text
+    # Column data starts at a multiple of 8 bytes
+    return header_bytes + b' ' * (-len(header_bytes) % 8)
+
+
+def decode_binary_header(data):
+    '''
+    Decode the header of a binary column file, returning the header and the
+    offset of column data
+    '''
+    magic_length = len(BINARY_MAGIC)
+    if bytes(data[:magic_length]) != BINARY_MAGIC:
+        raise ValueError('Not a binary column file')
+    header_length = struct.unpack_from('<I', data, magic_length)[0]
+    header_start = magic_length + 4
+    header_text = bytes(data[header_start:header_start + header_length])
+    header = json.loads(header_text.decode('utf-8'))
+    if header['version'] != BINARY_VERSION:
+        raise ValueError('Unsupported binary column file version')
+    offset = header_start + header_length
+    return header, offset + (-offset % 8)
+
+
+class BinaryTableWriter:
+    '''
+    Write a columnar table chunk by chunk into a binary column file
+    '''
+
+    def __init__(self, filename, fieldnames, rows_number, metadata=None):
+        header = dict(metadata or {})
+        header.update({'version': BINARY_VERSION, 'type': TYPE_CODE,
+                       'fieldnames': list(fieldnames), 'rows': rows_number})
+        header_bytes = encode_binary_header(header)
+        self.filename = filename
+        self.rows_number = rows_number
+        self.offset = len(header_bytes)
+        # Rows already written
+        self.position = 0
+        # Write to a temporary file so interrupted runs leave no partial data
+        self.data_file = open(filename + '.tmp', 'wb')
+        self.data_file.write(header_bytes)
+        self.data_file.truncate(self.offset + rows_number * len(fieldnames))
+
+    def write(self, chunk):
+        '''
+        Write the columns of a chunk after the rows already written
+        '''
+        for index, column in enumerate(chunk.columns):
+            self.data_file.seek(self.offset + index * self.rows_number +
+                                self.position)
+            self.data_file.write(column.tobytes())
+        self.position += len(chunk)
+
+    def close(self):
+        '''
+        Finish the file
+        '''
+        self.data_file.close()
+        os.replace(self.filename + '.tmp', self.filename)
+
+
+def read_csv_table(filename):
+    '''
+    Read a CSV file of integer attributes into a columnar table
+    '''
+    data_file = open(filename, 'r')
+    reader = csv.reader(data_file, skipinitialspace=True)
+    fieldnames = next(reader)
+    columns = [[] for _ in fieldnames]
+    for row in reader:
+        for index, value in enumerate(row):
+            columns[index].append(int(value))
+    data_file.close()
+    return Table(fieldnames, [new_column(column) for column in columns])
+
+
+def read_binary_table(filename):
+    '''
+    Memory-map a binary column file, returning a table whose columns are
+    views on the file (no copy) and the file header
+    '''
+    data_file = open(filename, 'rb')
+    data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+    data_file.close()
+    header, offset = decode_binary_header(data)
+    rows_number = header['rows']
+    columns = []
+    for index, _ in enumerate(header['fieldnames']):
+        start = offset + index * rows_number
+        if numpy is not None:
+            columns.append(numpy.frombuffer(data, dtype=numpy.uint8,
+                                            count=rows_number, offset=start))
+        else:
+            columns.append(memoryview(data)[start:start + rows_number])
+    return Table(header['fieldnames'], columns), header
+
+
+def copy_binary_prefix(source_filename, filename, rows_number):
+    '''
+    Store the first rows of a binary column file into another file
+    '''
+    # Check if file does not exists
+    if os.path.isfile(filename):
+        return 0
+    # Columns are copied, so the source file is closed when done
+    with open(source_filename, 'rb') as data_file, \
+            mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header, offset = decode_binary_header(data)
+        metadata = {key: value for key, value in header.items()
+                    if key not in ['version', 'type', 'fieldnames', 'rows']}
+        fieldnames = header['fieldnames']
+        columns = []
+        for index, _ in enumerate(fieldnames):
+            start = offset + index * header['rows']
+            columns.append(array(TYPE_CODE, data[start:start + rows_number]))
+    writer = BinaryTableWriter(filename, fieldnames, rows_number, metadata)
+    writer.write(Table(fieldnames, columns))
+    writer.close()
+    return rows_number
+
+
+def file_digest(filename):
+    '''
+    Return the SHA-1 digest of the content of a file
+    '''
+    digest = hashlib.sha1()
+    data_file = open(filename, 'rb')
+    for block in iter(lambda: data_file.read(1 << 20), b''):
+        digest.update(block)
+    data_file.close()
+    return digest.hexdigest()
+
+
 def append_to_csv(filename, attribute_list, record_list):
     '''
     Append record list into a CSV file
@@ -1,59 +1,178 @@
+CREATE TABLE IF NOT EXISTS cprefsql_stats (
+    run_id TEXT,
+    func TEXT,
+    input_rows BIGINT,
+    output_rows BIGINT,
+    cpu_user DOUBLE PRECISION,
+    cpu_system DOUBLE PRECISION,
+    elapsed DOUBLE PRECISION,
+    peak_memory DOUBLE PRECISION,
+    created TIMESTAMP DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION cprefsql_store_stats( func text,
+    input_rows bigint, output_rows bigint, start_user double precision,
+    start_system double precision, elapsed double precision)
+RETURNS void AS
+$$
+    import resource
+
+    # Backend usage since the start of the preference function
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    rv = plpy.execute("SELECT current_setting('cprefsql.run_id', true) AS run_id;")
+    plan = plpy.prepare('INSERT INTO cprefsql_stats VALUES '
+                        '( $1, $2, $3, $4, $5, $6, $7, $8 );',
+                        ['text', 'text', 'bigint', 'bigint',
+                         'double precision', 'double precision',
+                         'double precision', 'double precision'])
+    plpy.execute(plan, [rv[0]['run_id'], func, input_rows, output_rows,
+                        usage.ru_utime - start_user,
+                        usage.ru_stime - start_system, elapsed,
+                        usage.ru_maxrss / 1024.0])
+$$ LANGUAGE plpython3u;
+
+DROP FUNCTION IF EXISTS cprefsql_init(integer);
+
+CREATE OR REPLACE FUNCTION cprefsql_init()
+RETURNS void AS
+$$
+    import importlib
+    import sys
+
+    class PreferenceCache:
+        '''
+        Algorithm functions imported by the session (preferences are parsed
+        by the algorithms on each call)
+        '''
+
+        def __init__(self):
+            # (module, function) -> function
+            self.function_dict = {}
+            # Calls finding their function already imported, or not
+            self.hits = 0
+            self.misses = 0
+
+        def function(self, module_name, function_name):
+            key = (module_name, function_name)
+            if key in self.function_dict:
+                self.hits += 1
+            else:
+                self.misses += 1
+                # Algorithms and modules of this repository (sqlnative)
+                for path in ["/home/lucas/trabalho",
+                             "/home/lucas/trabalho/cprefsql"]:
+                    if path not in sys.path:
+                        sys.path.append(path)
+                module = importlib.import_module(module_name)
+                self.function_dict[key] = getattr(module, function_name)
+            return self.function_dict[key]
+
+    GD['cprefsql'] = PreferenceCache()
+$$ LANGUAGE plpython3u;
+
+DROP FUNCTION IF EXISTS cprefsql_cache_stats();
+
+CREATE OR REPLACE FUNCTION cprefsql_cache_stats()
+RETURNS TABLE ( functions integer, hits bigint, misses bigint ) AS
+$$
+    if 'cprefsql' not in GD:
+        return [(0, 0, 0)]
+    cache = GD['cprefsql']
+    return [(len(cache.function_dict), cache.hits, cache.misses)]
+$$ LANGUAGE plpython3u;
+
 CREATE OR REPLACE FUNCTION best_bnl( prefs text) 
 RETURNS TABLE (like r) AS 
 $$
-    import sys
-    sys.path.append("/home/lucas/trabalho")
+    import resource
+    import time
 
-    from algorithms.nested_loops import get_best
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_best = GD['cprefsql'].function('algorithms.nested_loops', 'get_best')
     
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
     rv = plpy.execute('SELECT * FROM r;')
     
     BEST_LIST = get_best(prefs, list(rv))
     
+    plpy.execute("SELECT cprefsql_store_stats('best_bnl', {i}, {o}, {u}, {s}, {t});".format(
+        i=rv.nrows(), o=len(BEST_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
     return BEST_LIST
 $$ LANGUAGE plpython3u;
 
 CREATE OR REPLACE FUNCTION topk_bnl( prefs text, topk integer) 
 RETURNS TABLE (like r) AS 
 $$
-    import sys
-    sys.path.append("/home/lucas/trabalho")
+    import resource
+    import time
 
-    from algorithms.nested_loops import get_topk
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_topk = GD['cprefsql'].function('algorithms.nested_loops', 'get_topk')
     
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
     rv = plpy.execute('SELECT * FROM r;')
     
     TOPK_LIST = get_topk(prefs, list(rv), topk)
     
+    plpy.execute("SELECT cprefsql_store_stats('topk_bnl', {i}, {o}, {u}, {s}, {t});".format(
+        i=rv.nrows(), o=len(TOPK_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
     return TOPK_LIST
 $$ LANGUAGE plpython3u;
 
 CREATE OR REPLACE FUNCTION best_partition( prefs text ) 
 RETURNS TABLE (like r) AS 
 $$
-    import sys
-    sys.path.append("/home/lucas/trabalho")
+    import resource
+    import time
 
-    from algorithms.partition import get_best_partition
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_best_partition = GD['cprefsql'].function('algorithms.partition', 'get_best_partition')
     
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
     rv = plpy.execute('SELECT * FROM r;')
     BEST_LIST = get_best_partition(prefs, list(rv))
     
+    plpy.execute("SELECT cprefsql_store_stats('best_partition', {i}, {o}, {u}, {s}, {t});".format(
+        i=rv.nrows(), o=len(BEST_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
     return BEST_LIST
 $$ LANGUAGE plpython3u;
 
 CREATE OR REPLACE FUNCTION topk_partition( prefs text, topk integer) 
 RETURNS TABLE (like r) AS 
 $$
-    import sys
-    sys.path.append("/home/lucas/trabalho")
+    import resource
+    import time
 
-    from algorithms.partition import get_topk_partition
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_topk_partition = GD['cprefsql'].function('algorithms.partition', 'get_topk_partition')
     
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
     rv = plpy.execute('SELECT * FROM r;')
     
     TOPK_LIST = get_topk_partition(prefs, list(rv), topk)
     
+    plpy.execute("SELECT cprefsql_store_stats('topk_partition', {i}, {o}, {u}, {s}, {t});".format(
+        i=rv.nrows(), o=len(TOPK_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
     return TOPK_LIST
 $$ LANGUAGE plpython3u;
 
@@ -62,29 +181,400 @@ $$ LANGUAGE plpython3u;
 CREATE OR REPLACE FUNCTION best_maxpref( prefs text) 
 RETURNS TABLE (like r) AS 
 $$
-    import sys
-    sys.path.append("/home/lucas/trabalho")
+    import resource
+    import time
 
-    from algorithms.maxpref import get_mbest_partition
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_mbest_partition = GD['cprefsql'].function('algorithms.maxpref', 'get_mbest_partition')
     
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
     rv = plpy.execute('SELECT * FROM r;')
     
     BEST_LIST = get_mbest_partition(prefs, list(rv))
     
+    plpy.execute("SELECT cprefsql_store_stats('best_maxpref', {i}, {o}, {u}, {s}, {t});".format(
+        i=rv.nrows(), o=len(BEST_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
     return BEST_LIST
 $$ LANGUAGE plpython3u;
 
 CREATE OR REPLACE FUNCTION topk_maxpref( prefs text, topk integer) 
 RETURNS TABLE (like r) AS 
 $$
-    import sys
-    sys.path.append("/home/lucas/trabalho")
+    import resource
+    import time
 
-    from algorithms.maxpref import get_mtopk_partition
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_mtopk_partition = GD['cprefsql'].function('algorithms.maxpref', 'get_mtopk_partition')
     
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
     rv = plpy.execute('SELECT * FROM r;')
     
     TOPK_LIST = get_mtopk_partition(prefs, list(rv), topk)
     
+    plpy.execute("SELECT cprefsql_store_stats('topk_maxpref', {i}, {o}, {u}, {s}, {t});".format(
+        i=rv.nrows(), o=len(TOPK_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
+    return TOPK_LIST
+$$ LANGUAGE plpython3u;
+
+CREATE OR REPLACE FUNCTION best_bnl_stream( prefs text, batch integer )
+RETURNS SETOF r AS
+$$
+    import resource
+    import time
+
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_best = GD['cprefsql'].function('algorithms.nested_loops', 'get_best')
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    # Table is read in batches into a single list of records
+    rec_list = []
+    cursor = plpy.cursor('SELECT * FROM r;')
+    while True:
+        rv = cursor.fetch(batch)
+        if not rv:
+            break
+        rec_list.extend(rv)
+
+    BEST_LIST = get_best(prefs, rec_list)
+
+    plpy.execute("SELECT cprefsql_store_stats('best_bnl_stream', {i}, {o}, {u}, {s}, {t});".format(
+        i=len(rec_list), o=len(BEST_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
+    # Records are returned one at a time
+    for rec in BEST_LIST:
+        yield rec
+$$ LANGUAGE plpython3u;
+
+CREATE OR REPLACE FUNCTION topk_bnl_stream( prefs text, topk integer, batch integer )
+RETURNS SETOF r AS
+$$
+    import resource
+    import time
+
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_topk = GD['cprefsql'].function('algorithms.nested_loops', 'get_topk')
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    # Table is read in batches into a single list of records
+    rec_list = []
+    cursor = plpy.cursor('SELECT * FROM r;')
+    while True:
+        rv = cursor.fetch(batch)
+        if not rv:
+            break
+        rec_list.extend(rv)
+
+    TOPK_LIST = get_topk(prefs, rec_list, topk)
+
+    plpy.execute("SELECT cprefsql_store_stats('topk_bnl_stream', {i}, {o}, {u}, {s}, {t});".format(
+        i=len(rec_list), o=len(TOPK_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
+    # Records are returned one at a time
+    for rec in TOPK_LIST:
+        yield rec
+$$ LANGUAGE plpython3u;
+
+CREATE OR REPLACE FUNCTION best_partition_stream( prefs text, batch integer )
+RETURNS SETOF r AS
+$$
+    import resource
+    import time
+
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_best_partition = GD['cprefsql'].function('algorithms.partition', 'get_best_partition')
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    # Table is read in batches into a single list of records
+    rec_list = []
+    cursor = plpy.cursor('SELECT * FROM r;')
+    while True:
+        rv = cursor.fetch(batch)
+        if not rv:
+            break
+        rec_list.extend(rv)
+
+    BEST_LIST = get_best_partition(prefs, rec_list)
+
+    plpy.execute("SELECT cprefsql_store_stats('best_partition_stream', {i}, {o}, {u}, {s}, {t});".format(
+        i=len(rec_list), o=len(BEST_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
+    # Records are returned one at a time
+    for rec in BEST_LIST:
+        yield rec
+$$ LANGUAGE plpython3u;
+
+CREATE OR REPLACE FUNCTION topk_partition_stream( prefs text, topk integer, batch integer )
+RETURNS SETOF r AS
+$$
+    import resource
+    import time
+
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_topk_partition = GD['cprefsql'].function('algorithms.partition', 'get_topk_partition')
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    # Table is read in batches into a single list of records
+    rec_list = []
+    cursor = plpy.cursor('SELECT * FROM r;')
+    while True:
+        rv = cursor.fetch(batch)
+        if not rv:
+            break
+        rec_list.extend(rv)
+
+    TOPK_LIST = get_topk_partition(prefs, rec_list, topk)
+
+    plpy.execute("SELECT cprefsql_store_stats('topk_partition_stream', {i}, {o}, {u}, {s}, {t});".format(
+        i=len(rec_list), o=len(TOPK_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
+    # Records are returned one at a time
+    for rec in TOPK_LIST:
+        yield rec
+$$ LANGUAGE plpython3u;
+
+CREATE OR REPLACE FUNCTION best_maxpref_stream( prefs text, batch integer )
+RETURNS SETOF r AS
+$$
+    import resource
+    import time
+
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_mbest_partition = GD['cprefsql'].function('algorithms.maxpref', 'get_mbest_partition')
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    # Table is read in batches into a single list of records
+    rec_list = []
+    cursor = plpy.cursor('SELECT * FROM r;')
+    while True:
+        rv = cursor.fetch(batch)
+        if not rv:
+            break
+        rec_list.extend(rv)
+
+    BEST_LIST = get_mbest_partition(prefs, rec_list)
+
+    plpy.execute("SELECT cprefsql_store_stats('best_maxpref_stream', {i}, {o}, {u}, {s}, {t});".format(
+        i=len(rec_list), o=len(BEST_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
+    # Records are returned one at a time
+    for rec in BEST_LIST:
+        yield rec
+$$ LANGUAGE plpython3u;
+
+CREATE OR REPLACE FUNCTION topk_maxpref_stream( prefs text, topk integer, batch integer )
+RETURNS SETOF r AS
+$$
+    import resource
+    import time
+
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    get_mtopk_partition = GD['cprefsql'].function('algorithms.maxpref', 'get_mtopk_partition')
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    # Table is read in batches into a single list of records
+    rec_list = []
+    cursor = plpy.cursor('SELECT * FROM r;')
+    while True:
+        rv = cursor.fetch(batch)
+        if not rv:
+            break
+        rec_list.extend(rv)
+
+    TOPK_LIST = get_mtopk_partition(prefs, rec_list, topk)
+
+    plpy.execute("SELECT cprefsql_store_stats('topk_maxpref_stream', {i}, {o}, {u}, {s}, {t});".format(
+        i=len(rec_list), o=len(TOPK_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
+    # Records are returned one at a time
+    for rec in TOPK_LIST:
+        yield rec
+$$ LANGUAGE plpython3u;
+
+DROP FUNCTION IF EXISTS preference_classes( text, text, integer, text[] );
+DROP FUNCTION IF EXISTS preference_classes( text, text, integer, text[],
+    boolean, boolean );
+
+CREATE OR REPLACE FUNCTION preference_classes( func text, prefs text,
+    topk integer, signature text[], attributes text[],
+    compress boolean DEFAULT true, project boolean DEFAULT false )
+RETURNS SETOF r AS
+$$
+    import resource
+    import time
+
+    # Algorithm of each preference function
+    function_dict = {
+        'best_bnl': ('algorithms.nested_loops', 'get_best'),
+        'topk_bnl': ('algorithms.nested_loops', 'get_topk'),
+        'best_partition': ('algorithms.partition', 'get_best_partition'),
+        'topk_partition': ('algorithms.partition', 'get_topk_partition'),
+        'best_maxpref': ('algorithms.maxpref', 'get_mbest_partition'),
+        'topk_maxpref': ('algorithms.maxpref', 'get_mtopk_partition')}
+
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    module_name, function_name = function_dict[func]
+    algorithm = GD['cprefsql'].function(module_name, function_name)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    columns = ', '.join([plpy.quote_ident(name) for name in signature])
+    # Attributes identifying a class of best records (with project,
+    # attributes of rules and the class of the other signature attributes)
+    key_list = list(signature)
+    source = 'r'
+    equal_list = []
+    if project:
+        equal_list = [name for name in signature if name not in attributes]
+        key_list = [name for name in signature if name in attributes]
+    if equal_list:
+        # Class of each tuple computed once (one sort of r), with its row id
+        rules = ', '.join([plpy.quote_ident(name) for name in key_list])
+        key_list.append('cprefsql_class')
+        source = 'cprefsql_classes'
+        plpy.execute('DROP TABLE IF EXISTS cprefsql_classes;')
+        plpy.execute('CREATE TEMP TABLE cprefsql_classes AS SELECT ctid AS row_id, {r}, DENSE_RANK() OVER ( ORDER BY {e} ) AS cprefsql_class FROM r;'.format(
+            r=rules, e=', '.join([plpy.quote_ident(name) for name in equal_list])))
+    keys = ', '.join([plpy.quote_ident(name) for name in key_list])
+    if compress and project:
+        # Projection of each class of tuples with the same signature
+        rv = plpy.execute('SELECT DISTINCT {k} FROM {s};'.format(k=keys, s=source))
+    elif compress:
+        # One tuple of each class of tuples with the same signature
+        rv = plpy.execute('SELECT DISTINCT ON ( {c} ) * FROM r;'.format(c=columns))
+    else:
+        # Projection of all tuples
+        rv = plpy.execute('SELECT {k} FROM {s};'.format(k=keys, s=source))
+
+    if topk < 0:
+        BEST_LIST = algorithm(prefs, list(rv))
+    else:
+        BEST_LIST = algorithm(prefs, list(rv), topk)
+
+    plpy.execute("SELECT cprefsql_store_stats('preference_classes', {i}, {o}, {u}, {s}, {t});".format(
+        i=rv.nrows(), o=len(BEST_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
+    if BEST_LIST and topk >= 0:
+        # Classes are truncated to k tuples in level order (records of the
+        # BEST of the list, then of the BEST of the rest, ...)
+        get_best = GD['cprefsql'].function('algorithms.nested_loops', 'get_best')
+        level_list = []
+        rest_list = BEST_LIST
+        while rest_list:
+            best_set = set([tuple([rec[name] for name in key_list])
+                            for rec in get_best(prefs, rest_list)])
+            first_list = [rec for rec in rest_list
+                          if tuple([rec[name] for name in key_list]) in best_set]
+            if not first_list:
+                level_list.extend(rest_list)
+                break
+            level_list.extend(first_list)
+            rest_list = [rec for rec in rest_list
+                         if tuple([rec[name] for name in key_list]) not in best_set]
+        BEST_LIST = level_list
+
+    if BEST_LIST:
+        # Tuples of the best classes, in their order (projected best records
+        # may repeat a class)
+        best_key_list = []
+        best_key_set = set()
+        for rec in BEST_LIST:
+            key = tuple([int(rec[name]) for name in key_list])
+            if key not in best_key_set:
+                best_key_set.add(key)
+                best_key_list.append(key)
+        value_list = []
+        for order, key in enumerate(best_key_list):
+            value_list.append('( {o}, {v} )'.format(
+                o=order, v=', '.join([str(value) for value in key])))
+        if equal_list:
+            # Tuples of the best classes are fetched by row id
+            query = 'WITH w ( cprefsql_order, {k} ) AS ( VALUES {v} ) ' \
+                'SELECT r.* FROM w JOIN cprefsql_classes c USING ( {k} ) ' \
+                'JOIN r ON r.ctid = c.row_id ORDER BY w.cprefsql_order'.format(
+                    k=keys, v=', '.join(value_list))
+        else:
+            query = 'WITH w ( cprefsql_order, {k} ) AS ( VALUES {v} ) ' \
+                'SELECT r.* FROM w JOIN r USING ( {k} ) ORDER BY w.cprefsql_order'.format(
+                    k=keys, v=', '.join(value_list))
+        if topk >= 0:
+            query += ' LIMIT {k}'.format(k=topk)
+        for rec in plpy.cursor(query):
+            yield rec
+$$ LANGUAGE plpython3u;
+
+DROP FUNCTION IF EXISTS preference_candidates( text, text, integer, text );
+
+CREATE OR REPLACE FUNCTION preference_candidates( func text, prefs text,
+    topk integer )
+RETURNS TABLE (like r) AS
+$$
+    import resource
+    import time
+
+    # TOP-k algorithm of each preference function
+    function_dict = {
+        'topk_bnl': ('algorithms.nested_loops', 'get_topk'),
+        'topk_partition': ('algorithms.partition', 'get_topk_partition'),
+        'topk_maxpref': ('algorithms.maxpref', 'get_mtopk_partition')}
+
+    # Algorithm functions are kept in the session cache
+    if 'cprefsql' not in GD:
+        plpy.execute('SELECT cprefsql_init();')
+    module_name, function_name = function_dict[func]
+    get_topk = GD['cprefsql'].function(module_name, function_name)
+    # Candidate query is built here from the preferences (rules are parsed
+    # into intervals and attribute names, not copied into SQL as text)
+    get_candidate_query = GD['cprefsql'].function('sqlnative',
+                                                  'get_candidate_query')
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.perf_counter()
+    fieldnames = plpy.execute('SELECT * FROM r LIMIT 0;').colnames()
+    # Only candidate tuples, ranked by the query
+    rv = plpy.execute(get_candidate_query(prefs, fieldnames, int(topk)))
+
+    TOPK_LIST = get_topk(prefs, list(rv), topk)
+
+    plpy.execute("SELECT cprefsql_store_stats('preference_candidates', {i}, {o}, {u}, {s}, {t});".format(
+        i=rv.nrows(), o=len(TOPK_LIST), u=usage.ru_utime, s=usage.ru_stime,
+        t=time.perf_counter() - start_time))
+
     return TOPK_LIST
 $$ LANGUAGE plpython3u;
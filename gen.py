@@ -5,13 +5,36 @@ Tuple and Preference generation
 '''
 
 
+import bisect
+import hashlib
 import random
+import sys
+from array import array
+
+from table import Table, TYPE_CODE, concat_tables, numpy
 
 # Parameter values related to generation of table data
 # Max value for attributes
 MAX_VALUE = 32
 # Min value for attributes
 MIN_VALUE = 0
+# Number of tuples generated at once
+CHUNK_SIZE = 50000
+
+# Data distributions
+UNIFORM = 'uniform'
+CORRELATED = 'correlated'
+ANTICORRELATED = 'anticorrelated'
+ZIPF = 'zipf'
+CLUSTERED = 'clustered'
+DISTRIBUTION_LIST = [UNIFORM, CORRELATED, ANTICORRELATED, ZIPF, CLUSTERED]
+# Max distance of (anti)correlated values from the base value of the tuple
+CORRELATION_SPREAD = 4
+# Exponent of Zipf distribution (value v has weight 1 / (v + 1) ** s)
+ZIPF_EXPONENT = 1.0
+# Number of clusters and max distance of values from cluster center
+CLUSTER_NUMBER = 8
+CLUSTER_SPREAD = 2
 
 # Preference rules format
 RULE_STRING = 'IF (0 <= a1 < {n0}) AND ({n1} <= a2 < {n2}) THEN ({x} <= a3 < {y}) BETTER ({y} <= a3 < {z}) {i}'
@@ -21,25 +44,230 @@ ACCORDING TO PREFERENCES
 {p};'''
 
 
-def gen_records(tup_number, att_number):
-    '''
-    Generate records
-    '''
-    # List of records
-    rec_list = []
-    # Loop to count the tuples number
-    for _ in range(tup_number):
-        # new tuple record
-        new_record = {}
-        # List of attributes
-        att_list = ['a' + str(number + 1) for number in range(att_number)]
-        # Generate each attribute value
-        for att in att_list:
-            new_record[att] = random.randint(0, MAX_VALUE)
-        # Append record into list of records
-        rec_list.append(new_record)
-    # Return built record list
-    return rec_list
+def gen_words(rng, tup_number):
+    '''
+    Generate one random 32 bits word per tuple (same stream with or without
+    NumPy)
+    '''
+    raw = rng.getrandbits(32 * tup_number).to_bytes(4 * tup_number, 'little')
+    if numpy is not None:
+        return numpy.frombuffer(raw, dtype='<u4').astype(numpy.uint64)
+    words = array('I')
+    words.frombytes(raw)
+    if sys.byteorder == 'big':
+        words.byteswap()
+    return words
+
+
+def gen_values(rng, tup_number, low, high):
+    '''
+    Generate uniform integer values in [low, high]
+    '''
+    # Number of distinct values
+    span = high - low + 1
+    words = gen_words(rng, tup_number)
+    if numpy is not None:
+        return ((words * span) >> 32).astype(numpy.int64) + low
+    return [low + ((word * span) >> 32) for word in words]
+
+
+def add_values(values, other_values):
+    '''
+    Add two sequences of values
+    '''
+    if numpy is not None:
+        return values + other_values
+    return [value + other for value, other in zip(values, other_values)]
+
+
+def mirror_values(values):
+    '''
+    Reflect values around the middle of [MIN_VALUE, MAX_VALUE]
+    '''
+    if numpy is not None:
+        return (MIN_VALUE + MAX_VALUE) - values
+    return [MIN_VALUE + MAX_VALUE - value for value in values]
+
+
+def values_to_column(values):
+    '''
+    Convert values into a typed column, clamping them to
+    [MIN_VALUE, MAX_VALUE]
+    '''
+    if numpy is not None:
+        return numpy.clip(values, MIN_VALUE, MAX_VALUE).astype(numpy.uint8)
+    return array(TYPE_CODE, [min(max(value, MIN_VALUE), MAX_VALUE)
+                             for value in values])
+
+
+def gen_column(rng, tup_number):
+    '''
+    Generate an attribute column with uniform values in [MIN_VALUE, MAX_VALUE]
+    '''
+    return values_to_column(gen_values(rng, tup_number, MIN_VALUE, MAX_VALUE))
+
+
+def gen_uniform(rng_of, tup_number, att_number):
+    '''
+    Independent uniform values
+    '''
+    return [gen_column(rng_of(column), tup_number)
+            for column in range(att_number)]
+
+
+def gen_correlated(rng_of, tup_number, att_number):
+    '''
+    Values close to a uniform base value of each tuple
+    '''
+    base = gen_values(rng_of('base'), tup_number, MIN_VALUE, MAX_VALUE)
+    columns = []
+    for column in range(att_number):
+        noise = gen_values(rng_of(column), tup_number,
+                           -CORRELATION_SPREAD, CORRELATION_SPREAD)
+        columns.append(values_to_column(add_values(base, noise)))
+    return columns
+
+
+def gen_anticorrelated(rng_of, tup_number, att_number):
+    '''
+    Values close to a uniform base value of each tuple on odd attributes and
+    close to its reflection on even attributes (a tuple good on one attribute
+    is bad on the next one)
+    '''
+    base = gen_values(rng_of('base'), tup_number, MIN_VALUE, MAX_VALUE)
+    mirror = mirror_values(base)
+    columns = []
+    for column in range(att_number):
+        noise = gen_values(rng_of(column), tup_number,
+                           -CORRELATION_SPREAD, CORRELATION_SPREAD)
+        center = base if column % 2 == 0 else mirror
+        columns.append(values_to_column(add_values(center, noise)))
+    return columns
+
+
+def gen_zipf(rng_of, tup_number, att_number):
+    '''
+    Independent values skewed towards MIN_VALUE following Zipf's law
+    '''
+    # Cumulative weights mapped into the space of 32 bits words
+    weight_list = [1 / (number + 1) ** ZIPF_EXPONENT
+                   for number in range(MAX_VALUE - MIN_VALUE + 1)]
+    total = sum(weight_list)
+    threshold_list = []
+    cumulative = 0
+    for weight in weight_list[:-1]:
+        cumulative += weight
+        threshold_list.append(int(cumulative / total * 2 ** 32))
+    columns = []
+    for column in range(att_number):
+        words = gen_words(rng_of(column), tup_number)
+        if numpy is not None:
+            values = numpy.searchsorted(
+                numpy.array(threshold_list, dtype=numpy.uint64), words,
+                side='right') + MIN_VALUE
+        else:
+            values = [MIN_VALUE + bisect.bisect_right(threshold_list, word)
+                      for word in words]
+        columns.append(values_to_column(values))
+    return columns
+
+
+def gen_clustered(rng_of, tup_number, att_number):
+    '''
+    Values close to the center of one of CLUSTER_NUMBER clusters
+    '''
+    # Cluster centers are the same for all shards of a table
+    center_rng = rng_of('centers', True)
+    center_list = [gen_values(center_rng, CLUSTER_NUMBER, MIN_VALUE,
+                              MAX_VALUE) for _ in range(att_number)]
+    cluster = gen_values(rng_of('cluster'), tup_number, 0,
+                         CLUSTER_NUMBER - 1)
+    columns = []
+    for column in range(att_number):
+        noise = gen_values(rng_of(column), tup_number,
+                           -CLUSTER_SPREAD, CLUSTER_SPREAD)
+        if numpy is not None:
+            center = center_list[column][cluster]
+        else:
+            center = [center_list[column][number] for number in cluster]
+        columns.append(values_to_column(add_values(center, noise)))
+    return columns
+
+
+# Column generation function of each distribution
+DISTRIBUTION_DICT = {UNIFORM: gen_uniform,
+                     CORRELATED: gen_correlated,
+                     ANTICORRELATED: gen_anticorrelated,
+                     ZIPF: gen_zipf,
+                     CLUSTERED: gen_clustered}
+
+
+def gen_attribute_list(att_number):
+    '''
+    Return the list of attribute names of a table
+    '''
+    return ['a' + str(number + 1) for number in range(att_number)]
+
+
+def shard_seed(seed, stream_id, shard, column):
+    '''
+    Derive the seed of a column of a shard from the table seed
+    '''
+    key = '{s}:{t}:{n}:{c}'.format(s=seed, t=stream_id, n=shard, c=column)
+    digest = hashlib.sha256(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+
+def gen_shard(tup_number, att_number, seed, stream_id, shard,
+              chunk_size=None, distribution=UNIFORM):
+    '''
+    Generate a shard (chunk of chunk_size tuples) of a table
+    '''
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    # Number of tuples in this shard
+    size = min(chunk_size, tup_number - shard * chunk_size)
+
+    # Each column of each shard has its own random generator, so shards are
+    # independent and a table is a prefix of any larger table of its stream
+    def rng_of(column, whole_table=False):
+        column_shard = 'table' if whole_table else shard
+        return random.Random(shard_seed(seed, stream_id, column_shard,
+                                        column))
+
+    columns = DISTRIBUTION_DICT[distribution](rng_of, size, att_number)
+    return Table(gen_attribute_list(att_number), columns)
+
+
+def gen_shard_number(tup_number, chunk_size=None):
+    '''
+    Return the number of shards of a table
+    '''
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    return (tup_number + chunk_size - 1) // chunk_size
+
+
+def gen_chunks(tup_number, att_number, seed=None, stream_id='',
+               chunk_size=None, distribution=UNIFORM):
+    '''
+    Generate records as a sequence of columnar tables of chunk_size tuples
+    '''
+    if seed is None:
+        seed = random.getrandbits(64)
+    # Generate shards in order
+    for shard in range(gen_shard_number(tup_number, chunk_size)):
+        yield gen_shard(tup_number, att_number, seed, stream_id, shard,
+                        chunk_size, distribution)
+
+
+def gen_records(tup_number, att_number, seed=None, stream_id='',
+                distribution=UNIFORM):
+    '''
+    Generate records as a columnar table
+    '''
+    return concat_tables(gen_chunks(tup_number, att_number, seed, stream_id,
+                                    distribution=distribution))
 
 
 def gen_rule(rule_dict):
@@ -5,6 +5,8 @@ import os
 import gen
 import file_handler
 import csv
+import hashlib
+import time
 
 '''
 CPrefSQLGen:
@@ -19,9 +21,14 @@ RUNTIME_RESULT_DIR = MAIN_DIR + os.sep + 'runtime_result'
 MEMORY_RESULT_DIR = MAIN_DIR + os.sep + 'memory_result'
 RULES_DIR = MAIN_DIR + os.sep + 'queries'
 DATA_DIR = MAIN_DIR + os.sep + 'data'
+DATASET_FILE = DATA_DIR + os.sep + 'datasets.csv'
+SNAPSHOT_DIR = MAIN_DIR + os.sep + 'snapshots'
+# Elapsed time of experiments (used to run longest experiments first)
+HISTORY_FILE = MAIN_DIR + os.sep + 'runtime_history.csv'
 
 DIR_LIST = [MAIN_DIR, DETAILS_DIR, RUNTIME_SUMMARY_DIR, MEMORY_SUMMARY_DIR,
-            RUNTIME_RESULT_DIR, MEMORY_RESULT_DIR, RULES_DIR, DATA_DIR]
+            RUNTIME_RESULT_DIR, MEMORY_RESULT_DIR, RULES_DIR, DATA_DIR,
+            SNAPSHOT_DIR]
 
 # List of attributes number for testing
 ATTRIBUTE_LIST = [8, 16, 32, 64]
@@ -59,10 +66,41 @@ TOPK_LIST = [-1, 12500, 25000, 50000, 100000, 200000]
 # Default Top-k number
 TOPK_DEFAULT = -1
 
+# Data distributions list
+DISTRIBUTION_LIST = gen.DISTRIBUTION_LIST
+# Default data distribution
+DISTRIBUTION_DEFAULT = gen.UNIFORM
+
 # Bases
 SQLITE = 'sqlite'
 POSTGRESQL = 'postgresql'
-BASE_LIST = [SQLITE, POSTGRESQL]
+# Table kept in memory, without database (lower bound of algorithm cost)
+MEMORY_BASE = 'memory'
+BASE_LIST = [SQLITE, POSTGRESQL, MEMORY_BASE]
+# Runner module of each base
+RUNNER_MODULE = {SQLITE: 'cprefsql_sqlite', POSTGRESQL: 'cprefsql_postgresql',
+                 MEMORY_BASE: 'cprefsql_memory'}
+# Bases run on a new process for each experiment (their memory is the peak
+# memory of the process), other bases run inside the generator process
+# Experiments of these bases may run in parallel, each one on its own CPU
+ISOLATED_BASES = [SQLITE, MEMORY_BASE]
+
+# Storage configurations: bare table with default settings, index on
+# preference attributes, larger pages and caches
+STORAGE_DEFAULT = 'default'
+STORAGE_INDEX = 'index'
+STORAGE_CACHE = 'cache'
+STORAGE_LIST = [STORAGE_DEFAULT, STORAGE_INDEX, STORAGE_CACHE]
+# Runner arguments of each storage configuration for each base (bases
+# missing from a configuration do not run it)
+STORAGE_ARGUMENTS = {
+    STORAGE_DEFAULT: {SQLITE: [], POSTGRESQL: [], MEMORY_BASE: []},
+    STORAGE_INDEX: {SQLITE: ['-I'], POSTGRESQL: ['-I']},
+    STORAGE_CACHE: {SQLITE: ['-p', 'page_size=8192',
+                             '-S', 'cache_size=-262144',
+                             '-S', 'mmap_size=1073741824'],
+                    POSTGRESQL: ['-S', 'work_mem=256MB',
+                                 '-S', 'effective_cache_size=4GB']}}
 
 # Experiment parameters
 ATT = 'att'
@@ -71,6 +109,8 @@ RUL = 'rul'
 LEV = 'lev'
 IND = 'ind'
 TOP = 'top'
+DIS = 'dis'
+STO = 'sto'
 ALG = 'alg'
 
 REW_DEFAULT = False
@@ -79,9 +119,11 @@ REW_DEFAULT = False
 TUP_ALG_PARTITION = 'partition'
 TUP_ALG_BNL_STAR_STAR = 'bnl'
 TUP_ALG_MAX_PREF = 'maxpref'
+# Preferences translated into SQL and evaluated by the database
+TUP_ALG_SQL_NATIVE = 'sqlnative'
 
 # List of algorithms for tuples
-TUP_ALG_LIST = [TUP_ALG_PARTITION, TUP_ALG_MAX_PREF]
+TUP_ALG_LIST = [TUP_ALG_PARTITION, TUP_ALG_MAX_PREF, TUP_ALG_SQL_NATIVE]
 # Default algorithm for tuples
 TUP_DEFAULT_ALG = TUP_ALG_MAX_PREF
 
@@ -90,9 +132,30 @@ TUP_ALG_LIST_BNL = [TUP_ALG_PARTITION, TUP_ALG_MAX_PREF, TUP_ALG_BNL_STAR_STAR]
 # Default algorithm for tuples for BNL test
 TUP_DEFAULT_ALG_BNL = TUP_ALG_BNL_STAR_STAR
 
+# Algorithms not run on each base (native SQL needs a database engine)
+BASE_EXCLUDED_ALGORITHMS = {MEMORY_BASE: [TUP_ALG_SQL_NATIVE]}
+
+# Seed for random generation of table data
+SEED = 0
+
+# Fields of the dataset manifest
+DATASET_FIELDS = ['table_id', TUP, ATT, 'seed', 'distribution', 'chunk',
+                  'key']
+
 EXPERIMENT_RERUN = 2
+# Runs not measured before the measured ones
+EXPERIMENT_WARMUP = 0
+# Number of experiments running at the same time (isolated bases)
+EXPERIMENT_WORKERS = 1
+# Shards generated at the same time for each job (bounds memory of shards
+# waiting to be written)
+SHARDS_PER_JOB = 2
 RUNTIME = "runtime"
+HISTORY_FIELDS = ['base', ALG, 'experiment_id', 'runs', 'elapsed',
+                  'timestamp']
 MEMORY = "memory"
+# Result size of each run
+SIZE = "size"
 
 # Confidense Interval
 CONFIDENCE_INTERVAL = 0.95
@@ -112,26 +175,88 @@ def get_query_id(n_rules, level, ind, top):
         operation
 
 
+def get_storage_id(storage):
+    '''
+    Return the ID of a storage configuration (empty for the default one)
+    '''
+    if storage == STORAGE_DEFAULT:
+        return ''
+    return STO + storage
+
+
 def get_experiment_id(exp_conf):
     '''
     Return the ID of an experiment
     '''
-    return get_table_id(exp_conf[TUP], exp_conf[ATT]) + get_query_id(exp_conf[RUL],exp_conf[LEV],exp_conf[IND],exp_conf[TOP])
+    return get_table_id(exp_conf[TUP], exp_conf[ATT], exp_conf[DIS]) + get_query_id(exp_conf[RUL],exp_conf[LEV],exp_conf[IND],exp_conf[TOP]) + \
+        get_storage_id(exp_conf.get(STO, STORAGE_DEFAULT))
+
+
+def get_table_id(tup_number, att_number, distribution):
+    '''
+    Return a table ID for given parameters (without distribution for the
+    default one, as before distributions were added)
+    '''
+    table_id = ATT + str(att_number) + TUP + str(tup_number)
+    if distribution == DISTRIBUTION_DEFAULT:
+        return table_id
+    return table_id + DIS + distribution
+
+
+def get_stream_id(att_number, distribution):
+    '''
+    Return the ID of the random stream shared by tables differing only on
+    tuples number (smaller tables are prefixes of larger ones)
+    '''
+    return ATT + str(att_number) + DIS + distribution
+
+
+def get_dataset_key(tup_number, att_number, seed, distribution):
+    '''
+    Return the manifest record identifying the content of a dataset
+    '''
+    dataset = {'table_id': get_table_id(tup_number, att_number,
+                                        distribution),
+               TUP: tup_number, ATT: att_number, 'seed': seed,
+               'distribution': distribution, 'chunk': gen.CHUNK_SIZE}
+    key_text = ':'.join([str(dataset[field])
+                         for field in DATASET_FIELDS[1:-1]])
+    dataset['key'] = hashlib.sha1(key_text.encode('utf-8')).hexdigest()
+    return dataset
+
+
+def read_dataset_manifest():
+    '''
+    Read the manifest of generated datasets (table ID -> dataset record)
+    '''
+    manifest = {}
+    if os.path.isfile(DATASET_FILE):
+        manifest_file = open(DATASET_FILE, 'r')
+        for rec in csv.DictReader(manifest_file, skipinitialspace=True):
+            manifest[rec['table_id']] = rec
+        manifest_file.close()
+    return manifest
 
 
-def get_table_id(tup_number, att_number):
+def write_dataset_manifest(dataset_list):
     '''
-    Return a table ID for given parameters
+    Store the manifest of generated datasets
     '''
-    return ATT + str(att_number) + \
-        TUP + str(tup_number)
+    temp_filename = DATASET_FILE + '.tmp'
+    manifest_file = open(temp_filename, 'w')
+    writer = csv.DictWriter(manifest_file, DATASET_FIELDS, delimiter=',',
+                            lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(dataset_list)
+    manifest_file.close()
+    os.replace(temp_filename, DATASET_FILE)
 
 
-def get_input_file(tupples, attributes):
+def get_input_file(tupples, attributes, distribution):
     '''
     Get filename for experiment input data
     '''
-    table_id = get_table_id(tupples, attributes)
+    table_id = get_table_id(tupples, attributes, distribution)
     filename = DATA_DIR + os.sep + table_id + '.csv'
     return filename
 
@@ -168,7 +293,8 @@ def gen_experiment_list():
     # Default parameters
     def_rec = {ALG: TUP_DEFAULT_ALG, ATT: ATTRIBUTE_DEFAULT,
                TUP: TUPLE_DEFAULT, RUL: RULE_DEFAULT, LEV: LEVEL_DEFAULT,
-               IND: INDIFF_DEFAULT, TOP: TOPK_DEFAULT}
+               IND: INDIFF_DEFAULT, TOP: TOPK_DEFAULT,
+               DIS: DISTRIBUTION_DEFAULT, STO: STORAGE_DEFAULT}
 
     # Standard experiments
     for alg in TUP_ALG_LIST:
@@ -210,11 +336,24 @@ def gen_experiment_list():
             rec[TOP] = topk_number
             add_experiment(exp_list, rec)
 
+        # data distribution variation
+        for distribution in DISTRIBUTION_LIST:
+            rec = def_rec.copy()
+            rec[DIS] = distribution
+            add_experiment(exp_list, rec)
+
+        # storage configuration variation
+        for storage in STORAGE_LIST:
+            rec = def_rec.copy()
+            rec[STO] = storage
+            add_experiment(exp_list, rec)
+
     # BNL experiments
     def_rec = {ALG: TUP_DEFAULT_ALG_BNL, ATT: ATTRIBUTE_DEFAULT,
                TUP: TUPLE_DEFAULT_BNL,
                RUL: RULE_DEFAULT, LEV: LEVEL_DEFAULT, IND: INDIFF_DEFAULT,
-               TOP: TOPK_DEFAULT}
+               TOP: TOPK_DEFAULT, DIS: DISTRIBUTION_DEFAULT,
+               STO: STORAGE_DEFAULT}
     for alg in TUP_ALG_LIST_BNL:
         def_rec[ALG] = alg
 
@@ -227,6 +366,24 @@ def gen_experiment_list():
     return exp_list
 
 
+def get_algorithm_list(base, algorithm_list=TUP_ALG_LIST):
+    '''
+    Return algorithms of a list run on a base
+    '''
+    excluded_list = BASE_EXCLUDED_ALGORITHMS.get(base, [])
+    return [alg for alg in algorithm_list if alg not in excluded_list]
+
+
+def is_base_experiment(base, experiment_conf):
+    '''
+    Check if an experiment runs on a base (its algorithm and its storage
+    configuration)
+    '''
+    storage = experiment_conf.get(STO, STORAGE_DEFAULT)
+    return base in STORAGE_ARGUMENTS[storage] and \
+        bool(get_algorithm_list(base, [experiment_conf[ALG]]))
+
+
 def initialize_directories():
     print("creating directories...")
     for directory in DIR_LIST:
@@ -234,24 +391,176 @@ def initialize_directories():
 
     for directory in BASE_LIST:
         file_handler.create_directory(DETAILS_DIR+os.sep+directory)
-        for alg in TUP_ALG_LIST_BNL:
+        for alg in get_algorithm_list(directory, TUP_ALG_LIST_BNL +
+                                      [TUP_ALG_SQL_NATIVE]):
             file_handler.create_directory(DETAILS_DIR+os.sep+directory+os.sep+alg)
 
 
-def create_experiments(exp_list):
+def gen_shard_csv(task):
+    '''
+    Generate a shard of a table and format it as CSV text (runs on workers)
+    '''
+    tup_number, att_number, seed, stream_id, shard, distribution = task
+    chunk = gen.gen_shard(tup_number, att_number, seed, stream_id, shard,
+                          distribution=distribution)
+    attribute_list = gen.gen_attribute_list(att_number)
+    return (len(chunk), file_handler.format_csv_chunk(chunk, attribute_list),
+            chunk)
+
+
+def write_dataset(dataset, part_list):
+    '''
+    Store parts (rows number, CSV text, chunk) of a dataset into its CSV file
+    and its binary column file
+    '''
+    filename = get_input_file(dataset[TUP], dataset[ATT],
+                              dataset['distribution'])
+    attribute_list = gen.gen_attribute_list(dataset[ATT])
+    metadata = {'seed': dataset['seed'],
+                'distribution': dataset['distribution']}
+    writer = file_handler.BinaryTableWriter(
+        file_handler.get_binary_file(filename), attribute_list,
+        dataset[TUP], metadata)
+
+    def csv_parts():
+        # Each chunk goes to binary file while its text goes to CSV file
+        for rows_number, text, chunk in part_list:
+            writer.write(chunk)
+            yield rows_number, text
+
+    file_handler.write_csv_parts(filename, attribute_list, csv_parts())
+    writer.close()
+
+
+def imap_bounded(pool, func, task_list, window):
+    '''
+    Apply a function to tasks on a pool of processes, yielding results in
+    task order with at most window tasks submitted and not yet consumed
+    '''
+    import collections
+    import itertools
+
+    task_iter = iter(task_list)
+    pending = collections.deque([pool.apply_async(func, (task,))
+                                 for task in itertools.islice(task_iter,
+                                                              window)])
+    while pending:
+        result = pending.popleft().get()
+        # A new task is submitted only when a result is consumed
+        for task in itertools.islice(task_iter, 1):
+            pending.append(pool.apply_async(func, (task,)))
+        yield result
+
+
+def gen_tables(dataset_list, jobs):
+    '''
+    Generate the data files of a list of datasets
+    '''
+    if jobs > 1:
+        import itertools
+        import multiprocessing
+
+        # Shards of all tables are generated by a pool of processes
+        task_list = []
+        for dataset in dataset_list:
+            stream_id = get_stream_id(dataset[ATT], dataset['distribution'])
+            for shard in range(gen.gen_shard_number(dataset[TUP])):
+                task_list.append((dataset[TUP], dataset[ATT],
+                                  dataset['seed'], stream_id, shard,
+                                  dataset['distribution']))
+        pool = multiprocessing.Pool(jobs)
+        # Results come back in task order, so files are written in order
+        part_iter = imap_bounded(pool, gen_shard_csv, task_list,
+                                 jobs * SHARDS_PER_JOB)
+        for dataset in dataset_list:
+            part_list = itertools.islice(part_iter,
+                                         gen.gen_shard_number(dataset[TUP]))
+            write_dataset(dataset, part_list)
+        pool.close()
+        pool.join()
+    else:
+        for dataset in dataset_list:
+            stream_id = get_stream_id(dataset[ATT], dataset['distribution'])
+            attribute_list = gen.gen_attribute_list(dataset[ATT])
+            # generate tupples (chunks are produced while the file is written)
+            chunks = gen.gen_chunks(dataset[TUP], dataset[ATT],
+                                    dataset['seed'], stream_id,
+                                    distribution=dataset['distribution'])
+            part_list = ((len(chunk),
+                          file_handler.format_csv_chunk(chunk, attribute_list),
+                          chunk) for chunk in chunks)
+            write_dataset(dataset, part_list)
+
+
+def create_datasets(exp_list, jobs=1, seed=SEED, prefix=False):
+    '''
+    Generate the data files required by the experiments, skipping files
+    whose manifest key matches (each dataset is generated at most once)
+    '''
+    # Datasets required by experiments (each table only once)
+    dataset_dict = {}
+    for exp in exp_list:
+        dataset = get_dataset_key(exp[TUP], exp[ATT], seed, exp[DIS])
+        dataset_dict[dataset['table_id']] = dataset
+
+    # Check datasets before generating anything
+    manifest = read_dataset_manifest()
+    missing_list = []
+    for table_id, dataset in dataset_dict.items():
+        filename = get_input_file(dataset[TUP], dataset[ATT],
+                                  dataset['distribution'])
+        binary_filename = file_handler.get_binary_file(filename)
+        if os.path.isfile(filename) and os.path.isfile(binary_filename) and \
+                table_id in manifest and \
+                manifest[table_id]['key'] == dataset['key']:
+            print("dataset up to date: ", filename)
+            continue
+        # Remove data generated with other parameters
+        for data_filename in [filename, binary_filename]:
+            if os.path.isfile(data_filename):
+                os.remove(data_filename)
+        missing_list.append(dataset)
+
+    # Tables derived as prefixes of the largest table of the same stream
+    derived_list = []
+    if prefix:
+        largest_dict = {}
+        for dataset in dataset_dict.values():
+            stream_id = get_stream_id(dataset[ATT], dataset['distribution'])
+            largest = largest_dict.get(stream_id)
+            if largest is None or dataset[TUP] > largest[TUP]:
+                largest_dict[stream_id] = dataset
+        gen_list = []
+        for dataset in missing_list:
+            stream_id = get_stream_id(dataset[ATT], dataset['distribution'])
+            if largest_dict[stream_id] is dataset:
+                gen_list.append(dataset)
+            else:
+                derived_list.append((dataset, largest_dict[stream_id]))
+        missing_list = gen_list
+
+    gen_tables(missing_list, jobs)
+    for dataset, source in derived_list:
+        source_filename = get_input_file(source[TUP], source[ATT],
+                                         source['distribution'])
+        filename = get_input_file(dataset[TUP], dataset[ATT],
+                                  dataset['distribution'])
+        file_handler.copy_csv_prefix(source_filename, filename, dataset[TUP])
+        file_handler.copy_binary_prefix(
+            file_handler.get_binary_file(source_filename),
+            file_handler.get_binary_file(filename), dataset[TUP])
+
+    # Store keys of all datasets (including datasets of other experiments)
+    manifest.update(dataset_dict)
+    write_dataset_manifest(list(manifest.values()))
+
+
+def create_experiments(exp_list, jobs=1, seed=SEED, prefix=False):
     # Generate directories
     initialize_directories()
 
     # Generate all data files
-    for exp in exp_list:
-        # generate tupples
-        recs = gen.gen_records(exp[TUP], exp[ATT])
-        # create csv file
-        attribute_list = list(recs[0].keys())
-        table_id = get_table_id(exp[TUP], exp[ATT])
-        filename = DATA_DIR + os.sep + table_id + '.csv'
-        # store in csv file
-        file_handler.write_to_csv(filename, attribute_list, recs)
+    create_datasets(exp_list, jobs, seed, prefix)
 
     # Generate Preference Rule Files
     for exp in exp_list:
@@ -266,48 +575,222 @@ def create_experiments(exp_list):
         file_handler.write_to_txt(filename, prefs)
 
 
-def run(experiment_conf, count, base):
+def get_run_arguments(experiment_conf, detail_file_list, base, warmup,
+                      trace=False):
     '''
-    Run experiment with parameters
+    Return the arguments of the runner of a base for an experiment
     '''
-
-    RUN_COMMAND_SQLITE = "python3 cprefsql_sqlite.py -d {d} -i {i} -r {r} -a {a} -t {t}"
-    RUN_COMMAND_POSTGRESQL = "python3 cprefsql_postgresql.py -d {d} -i {i} -r {r} -a {a} -t {t}"
-    experiment_id = get_experiment_id(experiment_conf)
-
     algorithm = experiment_conf[ALG]
-    detail_file = get_detail_file(algorithm, experiment_id, count, base)
-    input_file = get_input_file(experiment_conf[TUP], experiment_conf[ATT])
+    input_file = get_input_file(experiment_conf[TUP], experiment_conf[ATT],
+                                experiment_conf[DIS])
     rule_file = get_rule_file(experiment_conf[RUL], experiment_conf[LEV],
                               experiment_conf[IND], experiment_conf[TOP])
     topk = experiment_conf[TOP]
 
+    arg_list = ['-i', input_file, '-r', rule_file, '-a', algorithm,
+                '-t', str(topk), '-w', str(warmup)]
+    # One measured run for each detail file
+    for detail_file in detail_file_list:
+        arg_list += ['-d', detail_file]
     if base == SQLITE:
-        if not os.path.isfile(detail_file):
-            command = RUN_COMMAND_SQLITE.format(d=detail_file,
-                                                i=input_file, r=rule_file,
-                                                a=algorithm, t=topk)
-            print("running sql: ", command)
-            os.system(command)
+        arg_list += ['-s', SNAPSHOT_DIR]
     elif base == POSTGRESQL:
+        arg_list += ['-s']
+    if trace:
+        arg_list += ['-T']
+    # Storage configuration
+    arg_list += STORAGE_ARGUMENTS[experiment_conf.get(
+        STO, STORAGE_DEFAULT)][base]
+    return arg_list
+
+
+def run_runner(module_name, arg_list):
+    '''
+    Run the runner module of a base with arguments
+    '''
+    import importlib
+
+    module = importlib.import_module(module_name)
+    module.run(module.get_arguments(arg_list))
+
+
+def get_pending_files(experiment_conf, count_list, base):
+    '''
+    Return detail files of runs not done yet
+    '''
+    experiment_id = get_experiment_id(experiment_conf)
+    algorithm = experiment_conf[ALG]
+
+    detail_file_list = []
+    for count in count_list:
+        detail_file = get_detail_file(algorithm, experiment_id, count, base)
         if not os.path.isfile(detail_file):
-            command = RUN_COMMAND_POSTGRESQL.format(d=detail_file,
-                                                    i=input_file, r=rule_file,
-                                                    a=algorithm, t=topk)
-            print("running postgresql: ", command)
-            os.system(command)
+            detail_file_list.append(detail_file)
+    return detail_file_list
+
+
+def run(experiment_conf, count_list, base, warmup=EXPERIMENT_WARMUP,
+        trace=False):
+    '''
+    Run experiment with parameters (one measured run for each count)
+    '''
+    # Runs already done are skipped
+    detail_file_list = get_pending_files(experiment_conf, count_list, base)
+    if not detail_file_list:
+        return
+
+    arg_list = get_run_arguments(experiment_conf, detail_file_list, base,
+                                 warmup, trace)
+    print("running " + base + ": ", ' '.join(arg_list))
+    if base in ISOLATED_BASES:
+        import multiprocessing
+
+        # New interpreter, so peak memory of the process is only this run
+        context = multiprocessing.get_context('spawn')
+        process = context.Process(target=run_runner,
+                                  args=(RUNNER_MODULE[base], arg_list))
+        process.start()
+        process.join()
+    else:
+        try:
+            run_runner(RUNNER_MODULE[base], arg_list)
+        except Exception as e:
+            print(e)
+
+
+def read_runtime_history():
+    '''
+    Read elapsed time of previous runs ((base, algorithm, experiment ID) ->
+    seconds for each run, the last record is kept)
+    '''
+    history = {}
+    if os.path.isfile(HISTORY_FILE):
+        history_file = open(HISTORY_FILE, 'r')
+        for rec in csv.DictReader(history_file, skipinitialspace=True):
+            key = (rec['base'], rec[ALG], rec['experiment_id'])
+            history[key] = float(rec['elapsed']) / int(rec['runs'])
+        history_file.close()
+    return history
+
+
+def write_runtime_history(rec):
+    '''
+    Append elapsed time of an experiment to the history file
+    '''
+    if not os.path.isfile(HISTORY_FILE):
+        file_handler.write_to_csv(HISTORY_FILE, HISTORY_FIELDS, [rec])
+    else:
+        file_handler.append_to_csv(HISTORY_FILE, HISTORY_FIELDS, [rec])
+
+
+def get_cpu_list():
+    '''
+    Return the CPUs available to this process
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
 
 
-def run_experiments(experiment_list):
+def run_pinned(cpu, module_name, arg_list):
+    '''
+    Run the runner module of a base pinned to a single CPU
+    '''
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+    run_runner(module_name, arg_list)
+
+
+def schedule_experiments(unit_list, workers, warmup=EXPERIMENT_WARMUP,
+                         trace=False):
+    '''
+    Run experiments (base, experiment, detail files) on a pool of processes,
+    each one pinned to its own CPU, longest experiments first
+    '''
+    import multiprocessing
+    from multiprocessing.connection import wait
+
+    history = read_runtime_history()
+
+    def estimate(unit):
+        base, exp_rec, detail_file_list = unit
+        key = (base, exp_rec[ALG], get_experiment_id(exp_rec))
+        # Experiments without history come first (larger tables first)
+        if key not in history:
+            return (0, -exp_rec[TUP] * exp_rec[ATT])
+        return (1, -history[key] * len(detail_file_list))
+
+    pending_list = sorted(unit_list, key=estimate)
+    cpu_list = get_cpu_list()
+    workers = max(1, min(workers, len(cpu_list)))
+    free_cpu_list = cpu_list[:workers]
+    context = multiprocessing.get_context('spawn')
+    # Sentinel -> (process, CPU, unit, start time)
+    running = {}
+
+    while pending_list or running:
+        # Start experiments on free CPUs
+        while pending_list and free_cpu_list:
+            base, exp_rec, detail_file_list = pending_list.pop(0)
+            cpu = free_cpu_list.pop(0)
+            arg_list = get_run_arguments(exp_rec, detail_file_list, base,
+                                         warmup, trace)
+            print("running " + base + " on CPU " + str(cpu) + ": ",
+                  ' '.join(arg_list))
+            process = context.Process(target=run_pinned,
+                                      args=(cpu, RUNNER_MODULE[base],
+                                            arg_list))
+            process.start()
+            running[process.sentinel] = (process, cpu,
+                                         (base, exp_rec, detail_file_list),
+                                         time.time())
+
+        # Wait for any experiment to finish
+        for sentinel in wait(list(running.keys())):
+            process, cpu, unit, start_time = running.pop(sentinel)
+            process.join()
+            free_cpu_list.append(cpu)
+            base, exp_rec, detail_file_list = unit
+            if process.exitcode != 0:
+                print('Experiment failed: ' + get_experiment_id(exp_rec))
+                continue
+            write_runtime_history({'base': base, ALG: exp_rec[ALG],
+                                   'experiment_id': get_experiment_id(exp_rec),
+                                   'runs': len(detail_file_list),
+                                   'elapsed': round(time.time() - start_time,
+                                                    3),
+                                   'timestamp': time.time()})
+
+
+def run_experiments(experiment_list, warmup=EXPERIMENT_WARMUP,
+                    workers=EXPERIMENT_WORKERS, trace=False):
     '''
     Run all experiment
     '''
     repetition = EXPERIMENT_RERUN + 1
+    count_list = range(1, repetition + 1)
 
+    # Bases running on separate processes share the scheduler
+    unit_list = []
     for base in BASE_LIST:
+        if base not in ISOLATED_BASES:
+            continue
         for exp_rec in experiment_list:
-            for count in range(repetition):
-                run(exp_rec, count + 1, base)
+            if not is_base_experiment(base, exp_rec):
+                continue
+            detail_file_list = get_pending_files(exp_rec, count_list, base)
+            if detail_file_list:
+                unit_list.append((base, exp_rec, detail_file_list))
+    schedule_experiments(unit_list, workers, warmup, trace)
+
+    # Other bases (a single database server) run one experiment at a time
+    for base in BASE_LIST:
+        if base in ISOLATED_BASES:
+            continue
+        for exp_rec in experiment_list:
+            if not is_base_experiment(base, exp_rec):
+                continue
+            run(exp_rec, count_list, base, warmup, trace)
 
 
 def calculate_confidence_interval(confidence, values):
@@ -365,6 +848,27 @@ def summarize_confidence_interval(detail_file_list):
     return round(mem_mean,3), round(mem_conf,3), round(time_mean,3), round(time_conf,3)
 
 
+def summarize_size(detail_file_list):
+    '''
+    Return the mean result size of runs (None without detail files)
+    '''
+    size_list = []
+    for file_name in detail_file_list:
+        if not os.path.isfile(file_name):
+            print('File does not exists: ' + file_name)
+            return None
+
+        file_conf = open(file_name, 'r')
+        reader = csv.DictReader(file_conf, skipinitialspace=True)
+        for rec in reader:
+            size_list.append(float(rec[SIZE]))
+        file_conf.close()
+
+    if not size_list:
+        return None
+    return round(sum(size_list) / len(size_list), 3)
+
+
 def summarize_all():
     '''
     Summarize data from all experiments
@@ -377,12 +881,12 @@ def summarize_all():
         # Default parameters
         def_rec = {ATT: ATTRIBUTE_DEFAULT, TUP: TUPLE_DEFAULT,
                    RUL: RULE_DEFAULT, LEV: LEVEL_DEFAULT, IND: INDIFF_DEFAULT,
-                   TOP: TOPK_DEFAULT}
+                   TOP: TOPK_DEFAULT, DIS: DISTRIBUTION_DEFAULT}
 
         print("Experiments varying attribute number: ")
         filename = RUNTIME_SUMMARY_DIR + os.sep + base + "_" + ATT + ".csv"
         atributes = [ATT]
-        for algorithm in TUP_ALG_LIST:
+        for algorithm in get_algorithm_list(base):
             atributes.append(algorithm+"memmean")
             atributes.append(algorithm+"memconf")
             atributes.append(algorithm+"timemean")
@@ -394,7 +898,7 @@ def summarize_all():
             print("Experiment with ATT = ", att_number)
             algo_results = []
             algo_results.append(att_number)
-            for algorithm in TUP_ALG_LIST:
+            for algorithm in get_algorithm_list(base):
                 print("Experiments with algorithm: ", algorithm, "\n")
 
                 exp_rec = def_rec.copy()
@@ -423,7 +927,7 @@ def summarize_all():
         print("\nExperiments varying tupple number: ")
         filename = RUNTIME_SUMMARY_DIR + os.sep + base + "_" + TUP + ".csv"
         atributes = [TUP]
-        for algorithm in TUP_ALG_LIST:
+        for algorithm in get_algorithm_list(base):
             atributes.append(algorithm+"memmean")
             atributes.append(algorithm+"memconf")
             atributes.append(algorithm+"timemean")
@@ -435,7 +939,7 @@ def summarize_all():
             print("Experiment with TUP = ", tup_number)
             algo_results = []
             algo_results.append(tup_number)
-            for algorithm in TUP_ALG_LIST:
+            for algorithm in get_algorithm_list(base):
                 print("Experiments with algorithm: ", algorithm, "\n")
 
                 exp_rec = def_rec.copy()
@@ -464,7 +968,7 @@ def summarize_all():
         print("\nExperiments varying rule number: ")
         filename = RUNTIME_SUMMARY_DIR + os.sep + base + "_" + RUL + ".csv"
         atributes = [RUL]
-        for algorithm in TUP_ALG_LIST:
+        for algorithm in get_algorithm_list(base):
             atributes.append(algorithm+"memmean")
             atributes.append(algorithm+"memconf")
             atributes.append(algorithm+"timemean")
@@ -476,7 +980,7 @@ def summarize_all():
             print("Experiment with RUL = ", rules_number)
             algo_results = []
             algo_results.append(rules_number)
-            for algorithm in TUP_ALG_LIST:
+            for algorithm in get_algorithm_list(base):
                 print("Experiments with algorithm: ", algorithm, "\n")
 
                 exp_rec = def_rec.copy()
@@ -506,7 +1010,7 @@ def summarize_all():
         print("\nExperiments varying level number: ")
         filename = RUNTIME_SUMMARY_DIR + os.sep + base + "_" + LEV + ".csv"
         atributes = [LEV]
-        for algorithm in TUP_ALG_LIST:
+        for algorithm in get_algorithm_list(base):
             atributes.append(algorithm+"memmean")
             atributes.append(algorithm+"memconf")
             atributes.append(algorithm+"timemean")
@@ -518,7 +1022,7 @@ def summarize_all():
             print("Experiment with LEV = ", level)
             algo_results = []
             algo_results.append(level)
-            for algorithm in TUP_ALG_LIST:
+            for algorithm in get_algorithm_list(base):
                 print("Experiments with algorithm: ", algorithm, "\n")
 
                 exp_rec = def_rec.copy()
@@ -548,7 +1052,7 @@ def summarize_all():
         print("\nExperiments varying indifferent number: ")
         filename = RUNTIME_SUMMARY_DIR + os.sep + base + "_" + IND + ".csv"
         atributes = [IND]
-        for algorithm in TUP_ALG_LIST:
+        for algorithm in get_algorithm_list(base):
             atributes.append(algorithm+"memmean")
             atributes.append(algorithm+"memconf")
             atributes.append(algorithm+"timemean")
@@ -560,7 +1064,7 @@ def summarize_all():
             print("Experiment with IND = ", indif_number)
             algo_results = []
             algo_results.append(indif_number)
-            for algorithm in TUP_ALG_LIST:
+            for algorithm in get_algorithm_list(base):
                 print("Experiments with algorithm: ", algorithm, "\n")
 
                 exp_rec = def_rec.copy()
@@ -589,7 +1093,7 @@ def summarize_all():
         print("\nExperiments varying topk number: ")
         filename = RUNTIME_SUMMARY_DIR + os.sep + base + "_" + TOP + ".csv"
         atributes = [TOP]
-        for algorithm in TUP_ALG_LIST:
+        for algorithm in get_algorithm_list(base):
             atributes.append(algorithm+"memmean")
             atributes.append(algorithm+"memconf")
             atributes.append(algorithm+"timemean")
@@ -601,7 +1105,7 @@ def summarize_all():
             print("Experiment with TOP = ", topk_number)
             algo_results = []
             algo_results.append(topk_number)
-            for algorithm in TUP_ALG_LIST:
+            for algorithm in get_algorithm_list(base):
                 print("Experiments with algorithm: ", algorithm, "\n")
 
                 exp_rec = def_rec.copy()
@@ -628,6 +1132,95 @@ def summarize_all():
                 partial_results[atributes[i]] = algo_results[i]
             file_handler.append_to_csv(filename, atributes, [partial_results])
 
+        print("\nExperiments varying data distribution: ")
+        filename = RUNTIME_SUMMARY_DIR + os.sep + base + "_" + DIS + ".csv"
+        atributes = [DIS]
+        for algorithm in get_algorithm_list(base):
+            atributes.append(algorithm+"memmean")
+            atributes.append(algorithm+"memconf")
+            atributes.append(algorithm+"timemean")
+            atributes.append(algorithm+"timeconf")
+            # Runtime and memory are compared against result size
+            atributes.append(algorithm+"sizemean")
+        file_handler.write_to_csv(filename, atributes, [])
+
+        # Data distribution variation
+        for distribution in DISTRIBUTION_LIST:
+            print("Experiment with DIS = ", distribution)
+            algo_results = []
+            algo_results.append(distribution)
+            for algorithm in get_algorithm_list(base):
+                print("Experiments with algorithm: ", algorithm, "\n")
+
+                exp_rec = def_rec.copy()
+                exp_rec[DIS] = distribution
+                experiment_id = get_experiment_id(exp_rec)
+
+                detail_file_list = []
+                for count in range(repetition):
+                    count_file = count+1
+                    detail_file = get_detail_file(algorithm, experiment_id,
+                                                  count_file, base)
+                    detail_file_list.append(detail_file)
+
+                mem_mean, mem_conf, time_mean, time_conf = summarize_confidence_interval(detail_file_list)
+
+                algo_results.append(mem_mean)
+                algo_results.append(mem_conf)
+                algo_results.append(time_mean)
+                algo_results.append(time_conf)
+                algo_results.append(summarize_size(detail_file_list))
+
+            partial_results = {}
+
+            for i, _ in enumerate(algo_results):
+                partial_results[atributes[i]] = algo_results[i]
+            file_handler.append_to_csv(filename, atributes, [partial_results])
+
+        print("\nExperiments varying storage configuration: ")
+        filename = RUNTIME_SUMMARY_DIR + os.sep + base + "_" + STO + ".csv"
+        atributes = [STO]
+        for algorithm in get_algorithm_list(base):
+            atributes.append(algorithm+"memmean")
+            atributes.append(algorithm+"memconf")
+            atributes.append(algorithm+"timemean")
+            atributes.append(algorithm+"timeconf")
+        file_handler.write_to_csv(filename, atributes, [])
+
+        # Storage configuration variation
+        for storage in STORAGE_LIST:
+            if base not in STORAGE_ARGUMENTS[storage]:
+                continue
+            print("Experiment with STO = ", storage)
+            algo_results = []
+            algo_results.append(storage)
+            for algorithm in get_algorithm_list(base):
+                print("Experiments with algorithm: ", algorithm, "\n")
+
+                exp_rec = def_rec.copy()
+                exp_rec[STO] = storage
+                experiment_id = get_experiment_id(exp_rec)
+
+                detail_file_list = []
+                for count in range(repetition):
+                    count_file = count+1
+                    detail_file = get_detail_file(algorithm, experiment_id,
+                                                  count_file, base)
+                    detail_file_list.append(detail_file)
+
+                mem_mean, mem_conf, time_mean, time_conf = summarize_confidence_interval(detail_file_list)
+
+                algo_results.append(mem_mean)
+                algo_results.append(mem_conf)
+                algo_results.append(time_mean)
+                algo_results.append(time_conf)
+
+            partial_results = {}
+
+            for i, _ in enumerate(algo_results):
+                partial_results[atributes[i]] = algo_results[i]
+            file_handler.append_to_csv(filename, atributes, [partial_results])
+
     # Experiments with BNL
     for base in BASE_LIST:
         print("Experiments on ", base, "\n")
@@ -635,12 +1228,12 @@ def summarize_all():
         # Default parameters
         def_rec = {ATT: ATTRIBUTE_DEFAULT, TUP: TUPLE_DEFAULT_BNL,
                    RUL: RULE_DEFAULT, LEV: LEVEL_DEFAULT, IND: INDIFF_DEFAULT,
-                   TOP: TOPK_DEFAULT}
+                   TOP: TOPK_DEFAULT, DIS: DISTRIBUTION_DEFAULT}
 
         print("\nExperiments varying tupple number and BNL: ")
         filename = RUNTIME_SUMMARY_DIR + os.sep + base + "_" + TUP + "BNL" + ".csv"
         atributes = [TUP]
-        for algorithm in TUP_ALG_LIST_BNL:
+        for algorithm in get_algorithm_list(base, TUP_ALG_LIST_BNL):
             atributes.append(algorithm+"memmean")
             atributes.append(algorithm+"memconf")
             atributes.append(algorithm+"timemean")
@@ -652,7 +1245,7 @@ def summarize_all():
             print("Experiment with TUP = ", tup_number)
             algo_results = []
             algo_results.append(tup_number)
-            for algorithm in TUP_ALG_LIST_BNL:
+            for algorithm in get_algorithm_list(base, TUP_ALG_LIST_BNL):
                 print("Experiments with algorithm: ", algorithm, "\n")
 
                 exp_rec = def_rec.copy()
@@ -696,6 +1289,24 @@ def get_arguments(print_help=False):
     parser.add_argument('-s', '--summarize', action="store_true",
                         default=False,
                         help='Summarize results')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes to generate data')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='Seed for random generation of table data')
+    parser.add_argument('-w', '--warmup', type=int,
+                        default=EXPERIMENT_WARMUP,
+                        help='Number of runs before the measured ones')
+    parser.add_argument('--workers', type=int, default=EXPERIMENT_WORKERS,
+                        help='Number of experiments running at the same '
+                        'time (each one pinned to its own CPU)')
+    parser.add_argument('-T', '--trace', action="store_true",
+                        default=False,
+                        help='Store phases of each run as a Chrome trace '
+                        'file')
+    parser.add_argument('-p', '--prefix', action="store_true",
+                        default=False,
+                        help='Derive smaller tables as prefixes of the '
+                        'largest one')
     args = parser.parse_args()
     if print_help:
         parser.print_help()
@@ -715,10 +1326,10 @@ def main():
         # generating data
         print('Generating data')
         print('Generating queries')
-        create_experiments(exp_list)
+        create_experiments(exp_list, args.jobs, args.seed, args.prefix)
     elif args.run:
         print('Running experiments')
-        run_experiments(exp_list)
+        run_experiments(exp_list, args.warmup, args.workers, args.trace)
     elif args.summarize:
         print('Summarizing results')
         summarize_all()
@@ -0,0 +1,242 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+'''
+Phase timing and memory sampling of experiment runs
+'''
+
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Suffix of details file columns storing phase times
+PHASE_SUFFIX = '_time'
+
+# Extension of trace files (Chrome trace event format, opened by Perfetto)
+TRACE_EXTENSION = '.trace.json'
+
+# Extension of memory timeline files
+TIMELINE_EXTENSION = '.memory.csv'
+
+# Seconds between memory samples
+MEMORY_INTERVAL = 0.01
+
+# Resident set size of a process, in pages (second field)
+STATM_FILE = '/proc/{pid}/statm'
+if hasattr(os, 'sysconf'):
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+else:
+    PAGE_SIZE = 4096
+
+MEGABYTE = 1024.0 * 1024.0
+
+
+def get_phase_fields(phase_list):
+    '''
+    Return details file columns of a list of phases
+    '''
+    return [name + PHASE_SUFFIX for name in phase_list]
+
+
+def get_trace_file(details_file):
+    '''
+    Return the trace file of a details file
+    '''
+    return os.path.splitext(details_file)[0] + TRACE_EXTENSION
+
+
+def get_timeline_file(details_file):
+    '''
+    Return the memory timeline file of a details file
+    '''
+    return os.path.splitext(details_file)[0] + TIMELINE_EXTENSION
+
+
+def read_rss(pid):
+    '''
+    Return resident memory of a process in bytes (None if not readable)
+    '''
+    try:
+        statm_file = open(STATM_FILE.format(pid=pid), 'r')
+        fields = statm_file.read().split()
+        statm_file.close()
+    except OSError:
+        return None
+    return int(fields[1]) * PAGE_SIZE
+
+
+class MemorySampler:
+    '''
+    Thread sampling resident memory of processes at a fixed interval
+    '''
+
+    def __init__(self, pid_list, interval=MEMORY_INTERVAL):
+        # Processes sampled (e.g. this process and a database server)
+        self.pid_list = list(pid_list)
+        self.interval = interval
+        # Samples in time order (time, list of RSS for each process)
+        self.sample_list = []
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        '''
+        Take a sample of all processes
+        '''
+        self.sample_list.append((time.perf_counter_ns(),
+                                 [read_rss(pid) for pid in self.pid_list]))
+
+    def sample_loop(self):
+        '''
+        Take samples until the sampler is stopped
+        '''
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        '''
+        Start sampling on a background thread
+        '''
+        self.sample()
+        self.thread = threading.Thread(target=self.sample_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop sampling
+        '''
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.sample()
+
+    def get_peak(self, index, start, end):
+        '''
+        Return peak memory of a process between two instants, over the
+        memory it had at the first instant (MB, None if not sampled)
+        '''
+        base = None
+        peak = None
+        for sample_time, rss_list in self.sample_list:
+            rss = rss_list[index]
+            if rss is None:
+                continue
+            if sample_time <= start:
+                base = rss
+            elif sample_time <= end:
+                peak = rss if peak is None else max(peak, rss)
+        if base is None:
+            return None
+        if peak is None:
+            peak = base
+        return round(max(peak - base, 0) / MEGABYTE, 3)
+
+    def get_run_peak(self, index):
+        '''
+        Return peak memory of a process while sampled, over the memory it had
+        at the start (MB, None if not sampled)
+        '''
+        if not self.sample_list:
+            return None
+        return self.get_peak(index, self.sample_list[0][0],
+                             self.sample_list[-1][0])
+
+    def write_timeline(self, filename, name_list):
+        '''
+        Store samples as a CSV file (seconds since the first sample and MB
+        for each process)
+        '''
+        origin = self.sample_list[0][0] if self.sample_list else 0
+        timeline_file = open(filename, 'w')
+        writer = csv.writer(timeline_file, delimiter=',', lineterminator='\n')
+        writer.writerow(['time'] + name_list)
+        for sample_time, rss_list in self.sample_list:
+            writer.writerow([round((sample_time - origin) / 1e9, 6)] +
+                            ['' if rss is None else round(rss / MEGABYTE, 3)
+                             for rss in rss_list])
+        timeline_file.close()
+
+
+class PhaseTimer:
+    '''
+    Elapsed time of named phases of a run (nanoseconds)
+    '''
+
+    def __init__(self, sampler=None):
+        # Start of the timer, trace events are relative to it
+        self.origin = time.perf_counter_ns()
+        # Memory sampler, sampled at start and end of each phase
+        self.sampler = sampler
+        # Phase name -> elapsed time
+        self.elapsed = {}
+        # Phases in execution order (name, start, duration)
+        self.event_list = []
+
+    def add(self, name, start, duration):
+        '''
+        Add elapsed time to a phase
+        '''
+        self.elapsed[name] = self.elapsed.get(name, 0) + duration
+        self.event_list.append((name, start, duration))
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Time a block of code as a phase
+        '''
+        if self.sampler is not None:
+            self.sampler.sample()
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            # Last sample of the phase is taken before its end
+            if self.sampler is not None:
+                self.sampler.sample()
+            self.add(name, start, time.perf_counter_ns() - start)
+
+    def merge(self, timer):
+        '''
+        Add phases of another timer (e.g. data load done before the run)
+        '''
+        for name, start, duration in timer.event_list:
+            self.add(name, start, duration)
+
+    def get_span(self, name):
+        '''
+        Return start and end of the last execution of a phase
+        '''
+        for event_name, start, duration in reversed(self.event_list):
+            if event_name == name:
+                return start, start + duration
+        return None
+
+    def get_fields(self, phase_list):
+        '''
+        Return phase times in seconds as details file columns
+        '''
+        return {name + PHASE_SUFFIX:
+                round(self.elapsed.get(name, 0) / 1e9, 6)
+                for name in phase_list}
+
+    def write_trace(self, filename, process_name):
+        '''
+        Store phases as complete events of a Chrome trace file
+        '''
+        pid = os.getpid()
+        origin = min([start for _, start, _ in self.event_list] +
+                     [self.origin])
+        event_list = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'tid': 0, 'args': {'name': process_name}}]
+        for name, start, duration in self.event_list:
+            # Trace timestamps are microseconds
+            event_list.append({'name': name, 'cat': 'phase', 'ph': 'X',
+                               'pid': pid, 'tid': 0,
+                               'ts': (start - origin) / 1000.0,
+                               'dur': duration / 1000.0})
+        trace_file = open(filename, 'w')
+        json.dump({'traceEvents': event_list, 'displayTimeUnit': 'ms'},
+                  trace_file)
+        trace_file.close()
@@ -0,0 +1,79 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+'''
+Parsing of CPrefSQL preference rules (cp-rules)
+'''
+
+import re
+
+# Rules are joined by AND before the IF of the next rule
+RULE_SEPARATOR = re.compile(r'\s*\bAND\s+(?=IF\b)', re.IGNORECASE)
+# Parts of a rule: IF condition THEN preference [indifferent attributes]
+RULE_PATTERN = re.compile(r'^\s*IF\s+(?P<condition>.*?)\s+THEN\s+'
+                          r'(?P<preference>.*?)\s*'
+                          r'(\[(?P<indifferent>[^\]]*)\])?\s*$',
+                          re.IGNORECASE | re.DOTALL)
+# Attribute names inside comparisons
+ATTRIBUTE_PATTERN = re.compile(r'\b[A-Za-z_]\w*\b')
+# Words that are not attributes
+KEYWORD_LIST = ['IF', 'THEN', 'AND', 'OR', 'NOT', 'BETTER']
+
+
+def get_attributes(text):
+    '''
+    Return attributes in a text, in order of first occurrence
+    '''
+    attribute_list = []
+    for name in ATTRIBUTE_PATTERN.findall(text):
+        if name.upper() not in KEYWORD_LIST and name not in attribute_list:
+            attribute_list.append(name)
+    return attribute_list
+
+
+def parse_rule(rule_text):
+    '''
+    Convert a rule in string format into a rule dictionary with condition,
+    preferred and indifferent attributes
+    '''
+    match = RULE_PATTERN.match(rule_text)
+    if match is None:
+        raise ValueError('Invalid preference rule: ' + rule_text)
+    indifferent = match.group('indifferent') or ''
+    return {'condition': get_attributes(match.group('condition')),
+            'preferred': get_attributes(match.group('preference')),
+            'indifferent': [name.strip() for name in indifferent.split(',')
+                            if name.strip()]}
+
+
+def parse_rules(pref_text):
+    '''
+    Convert preferences (rules joined by AND) into a list of rule
+    dictionaries
+    '''
+    return [parse_rule(rule_text)
+            for rule_text in RULE_SEPARATOR.split(pref_text.strip())
+            if rule_text.strip()]
+
+
+def get_indifferent_attributes(rule_list):
+    '''
+    Return attributes indifferent for all rules
+    '''
+    indifferent_set = None
+    for rule in rule_list:
+        if indifferent_set is None:
+            indifferent_set = set(rule['indifferent'])
+        else:
+            indifferent_set &= set(rule['indifferent'])
+    return indifferent_set or set()
+
+
+def get_signature(fieldnames, rule_list):
+    '''
+    Return attributes deciding how a tuple compares with others (tuples
+    agreeing on them are dominated by and dominate the same tuples, since
+    rules compare tuples equal on all attributes but the preferred and the
+    indifferent ones)
+    '''
+    indifferent_set = get_indifferent_attributes(rule_list)
+    return [name for name in fieldnames if name not in indifferent_set]
@@ -0,0 +1,324 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+'''
+Translation of interval preference rules (rules built by gen.gen_rules) into
+SQL queries evaluated by the database engine
+'''
+
+import re
+import zlib
+
+from rules import RULE_PATTERN, RULE_SEPARATOR, parse_rules
+
+# Interval of an attribute: (low <= attribute < high)
+INTERVAL_PATTERN = re.compile(r'\(\s*(?P<low>\d+)\s*<=\s*'
+                              r'(?P<name>[A-Za-z_]\w*)\s*<\s*'
+                              r'(?P<high>\d+)\s*\)')
+
+# Column with the preference level of each tuple (TOP-k)
+LEVEL_COLUMN = 'cprefsql_level'
+
+# Prefix of indexes created for native queries
+INDEX_PREFIX = 'cprefsql_native_'
+
+# Prefix of indexes on preference attributes (storage configuration)
+PREFERENCE_INDEX_PREFIX = 'cprefsql_pref_'
+
+# Maximum number of index columns (PostgreSQL limit)
+INDEX_COLUMN_LIMIT = 32
+
+UNSUPPORTED_MESSAGE = 'Preference rule not supported by native SQL: '
+
+
+def get_intervals(text):
+    '''
+    Return intervals in a text (attribute, low, high) and the text left
+    '''
+    interval_list = [(match.group('name'), int(match.group('low')),
+                      int(match.group('high')))
+                     for match in INTERVAL_PATTERN.finditer(text)]
+    return interval_list, INTERVAL_PATTERN.sub(' ', text)
+
+
+def parse_native_rule(rule_text):
+    '''
+    Convert a rule (condition of intervals, an interval better than another
+    interval of the same attribute) into a rule dictionary
+    '''
+    match = RULE_PATTERN.match(rule_text)
+    if match is None:
+        raise ValueError('Invalid preference rule: ' + rule_text)
+    condition, left = get_intervals(match.group('condition'))
+    if left.upper().replace('AND', ' ').strip():
+        raise ValueError(UNSUPPORTED_MESSAGE + rule_text)
+    preference, left = get_intervals(match.group('preference'))
+    if len(preference) != 2 or left.strip().upper() != 'BETTER' or \
+            preference[0][0] != preference[1][0]:
+        raise ValueError(UNSUPPORTED_MESSAGE + rule_text)
+    indifferent = match.group('indifferent') or ''
+    return {'condition': tuple(sorted(condition)),
+            'attribute': preference[0][0],
+            'better': preference[0][1:],
+            'worse': preference[1][1:],
+            'indifferent': sorted([name.strip()
+                                   for name in indifferent.split(',')
+                                   if name.strip()])}
+
+
+def is_disjoint(condition, other_condition):
+    '''
+    Check if no tuple satisfies two conditions
+    '''
+    for name, low, high in condition:
+        for other_name, other_low, other_high in other_condition:
+            if name == other_name and (high <= other_low or
+                                       other_high <= low):
+                return True
+    return False
+
+
+def get_chain(better_dict):
+    '''
+    Return intervals ordered from the best one (None if rules do not form a
+    single chain of intervals)
+    '''
+    start_list = [interval for interval in better_dict
+                  if interval not in better_dict.values()]
+    if len(start_list) != 1:
+        return None
+    chain = [start_list[0]]
+    while chain[-1] in better_dict and len(chain) <= len(better_dict):
+        chain.append(better_dict[chain[-1]])
+    if len(chain) != len(better_dict) + 1 or len(set(chain)) != len(chain):
+        return None
+    # Tuples are in one interval at most
+    interval_list = sorted(chain)
+    for index in range(1, len(interval_list)):
+        if interval_list[index][0] < interval_list[index - 1][1]:
+            return None
+    return chain
+
+
+def parse_native_rules(pref_text):
+    '''
+    Convert preferences into a theory: preferred attribute, indifferent
+    attributes and blocks of rules with the same condition (condition and
+    chain of intervals from the best one)
+    '''
+    rule_list = [parse_native_rule(rule_text)
+                 for rule_text in RULE_SEPARATOR.split(pref_text.strip())
+                 if rule_text.strip()]
+    if not rule_list:
+        raise ValueError('No preference rules')
+    attribute = rule_list[0]['attribute']
+    indifferent = rule_list[0]['indifferent']
+
+    # Better interval -> worse interval, for each condition
+    block_dict = {}
+    for rule in rule_list:
+        if rule['attribute'] != attribute or \
+                rule['indifferent'] != indifferent:
+            raise ValueError('Rules with different preferred or indifferent '
+                             'attributes are not supported by native SQL')
+        better_dict = block_dict.setdefault(rule['condition'], {})
+        if rule['better'] in better_dict:
+            raise ValueError('Rules of a condition do not form a chain of '
+                             'intervals')
+        better_dict[rule['better']] = rule['worse']
+
+    block_list = []
+    for condition, better_dict in block_dict.items():
+        chain = get_chain(better_dict)
+        if chain is None:
+            raise ValueError('Rules of a condition do not form a chain of '
+                             'intervals')
+        for other_condition, _ in block_list:
+            if not is_disjoint(condition, other_condition):
+                raise ValueError('Rule conditions overlap')
+        block_list.append((condition, chain))
+    return {'attribute': attribute, 'indifferent': indifferent,
+            'blocks': block_list}
+
+
+def get_equal_attributes(fieldnames, theory):
+    '''
+    Return attributes equal in compared tuples (all but the preferred and
+    the indifferent ones)
+    '''
+    return [name for name in fieldnames
+            if name != theory['attribute'] and
+            name not in theory['indifferent']]
+
+
+def get_interval_condition(interval_list, alias):
+    '''
+    Return the SQL condition of a list of intervals
+    '''
+    if not interval_list:
+        return '1 = 1'
+    return ' AND '.join(['{l} <= {a}.{n} AND {a}.{n} < {h}'.format(
+        a=alias, n=name, l=low, h=high) for name, low, high in interval_list])
+
+
+def get_block_expression(theory, alias):
+    '''
+    Return the SQL expression of the rule block of a tuple (NULL out of all
+    conditions)
+    '''
+    return 'CASE {w} END'.format(w=' '.join(
+        ['WHEN {c} THEN {b}'.format(c=get_interval_condition(condition,
+                                                             alias), b=index)
+         for index, (condition, _) in enumerate(theory['blocks'])]))
+
+
+def get_position_expression(theory, alias):
+    '''
+    Return the SQL expression of the position of a tuple in the chain of its
+    block, 0 for the best interval (NULL out of all intervals)
+    '''
+    when_list = []
+    for condition, chain in theory['blocks']:
+        for position, (low, high) in enumerate(chain):
+            when_list.append('WHEN {c} THEN {p}'.format(
+                c=get_interval_condition(
+                    list(condition) + [(theory['attribute'], low, high)],
+                    alias),
+                p=position))
+    return 'CASE {w} END'.format(w=' '.join(when_list))
+
+
+def get_best_query(theory, fieldnames):
+    '''
+    Return the BEST query (tuples not dominated by any other tuple, a tuple
+    dominates another one equal on all attributes but the preferred and the
+    indifferent ones, in the same block and in a better interval)
+    '''
+    equal_list = ['s.{n} = t.{n}'.format(n=name)
+                  for name in get_equal_attributes(fieldnames, theory)]
+    position_t = get_position_expression(theory, 't')
+    dominance = ' AND '.join(equal_list + [
+        '{s} = {t}'.format(s=get_block_expression(theory, 's'),
+                           t=get_block_expression(theory, 't')),
+        '{s} < {t}'.format(s=get_position_expression(theory, 's'),
+                           t=position_t)])
+    # Tuples in the best interval or out of all intervals are not dominated
+    return "SELECT t.* FROM r t WHERE COALESCE( {p}, 0 ) = 0 OR " \
+        "NOT EXISTS ( SELECT 1 FROM r s WHERE {d} );".format(p=position_t,
+                                                             d=dominance)
+
+
+def get_level_expression(theory, fieldnames):
+    '''
+    Return the SQL expression of the level of a tuple of table r, the number
+    of better intervals holding tuples equal to the tuple in the same block
+    (0 for tuples out of all intervals)
+    '''
+    position = get_position_expression(theory, 'r')
+    partition_list = get_equal_attributes(fieldnames, theory) + [
+        get_block_expression(theory, 'r'), '{p} IS NULL'.format(p=position)]
+    return "DENSE_RANK() OVER ( PARTITION BY {g} ORDER BY {p} ) - 1".format(
+        g=', '.join(partition_list), p=position)
+
+
+def get_topk_query(theory, fieldnames, topk):
+    '''
+    Return the TOP-k query (tuples ordered by level)
+    '''
+    return "SELECT {f} FROM ( SELECT r.*, {e} AS {l} FROM r ) t " \
+        "ORDER BY {l} LIMIT {k};".format(
+            f=', '.join(fieldnames), e=get_level_expression(theory, fieldnames),
+            l=LEVEL_COLUMN, k=topk)
+
+
+def get_candidate_query(pref_text, fieldnames, topk):
+    '''
+    Return the query of TOP-k candidates: tuples with level up to the level
+    of the k-th tuple ordered by level (dominators of a candidate are
+    candidates too, so algorithms find the same levels over candidates)
+    '''
+    theory = parse_native_rules(pref_text)
+    return "WITH t AS ( SELECT r.*, {e} AS {l} FROM r ) SELECT {f} FROM t " \
+        "WHERE {l} <= ( SELECT MAX( {l} ) FROM ( SELECT {l} FROM t " \
+        "ORDER BY {l} LIMIT {k} ) m );".format(
+            f=', '.join(fieldnames), e=get_level_expression(theory, fieldnames),
+            l=LEVEL_COLUMN, k=topk)
+
+
+def get_native_query(pref_text, fieldnames, topk=-1):
+    '''
+    Return the SQL query evaluating preferences over table r
+    '''
+    theory = parse_native_rules(pref_text)
+    if topk < 0:
+        return get_best_query(theory, fieldnames)
+    return get_topk_query(theory, fieldnames, topk)
+
+
+def get_index_columns(pref_text, fieldnames):
+    '''
+    Return the attributes of the index of table r for native queries
+    (compared tuples are found by their equal attributes, attributes of rule
+    conditions first, up to INDEX_COLUMN_LIMIT columns with the preferred
+    attribute as the last one)
+    '''
+    theory = parse_native_rules(pref_text)
+    equal_list = get_equal_attributes(fieldnames, theory)
+    rule_list = get_preference_attributes(pref_text)
+    column_list = [name for name in equal_list if name in rule_list] + \
+        [name for name in equal_list if name not in rule_list]
+    return column_list[:INDEX_COLUMN_LIMIT - 1] + [theory['attribute']]
+
+
+def get_index_list(pref_text, fieldnames, index=False, native=False):
+    '''
+    Return the indexes of table r (prefix and attributes) of a storage
+    configuration: index on preference attributes (with index) and index of
+    native queries (with native)
+    '''
+    index_list = []
+    if index:
+        index_list.append((PREFERENCE_INDEX_PREFIX,
+                           get_preference_attributes(
+                               pref_text)[:INDEX_COLUMN_LIMIT]))
+    if native:
+        index_list.append((INDEX_PREFIX,
+                           get_index_columns(pref_text, fieldnames)))
+    return index_list
+
+
+def is_index_name(name):
+    '''
+    Check if an index was created for a storage configuration
+    '''
+    return name.startswith(INDEX_PREFIX) or \
+        name.startswith(PREFERENCE_INDEX_PREFIX)
+
+
+def get_index_name(prefix, column_list):
+    '''
+    Return the name of an index of table r (the name identifies the columns
+    and fits in PostgreSQL identifiers)
+    '''
+    return prefix + '{c:08x}'.format(
+        c=zlib.crc32(','.join(column_list).encode()))
+
+
+def get_create_index(prefix, column_list):
+    '''
+    Return the query creating an index of table r
+    '''
+    return "CREATE INDEX IF NOT EXISTS {n} ON r ( {c} );".format(
+        n=get_index_name(prefix, column_list), c=', '.join(column_list))
+
+
+def get_preference_attributes(pref_text):
+    '''
+    Return attributes of rule conditions and preferences, in order of first
+    occurrence
+    '''
+    attribute_list = []
+    for rule in parse_rules(pref_text):
+        for name in rule['condition'] + rule['preferred']:
+            if name not in attribute_list:
+                attribute_list.append(name)
+    return attribute_list
@@ -0,0 +1,173 @@
+#!/usr/bin/python -u
+# -*- coding: utf-8 -*-
+'''
+Columnar table representation
+'''
+
+from array import array
+from collections.abc import Mapping
+
+# NumPy is optional, typed arrays from standard library are used without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Type code for attribute columns (values fit into an unsigned byte)
+TYPE_CODE = 'B'
+
+# Row representations: a dictionary for each row, or compact rows sharing
+# the attribute positions of their table
+ROW_DICT = 'dict'
+ROW_COMPACT = 'compact'
+ROW_FORMAT_LIST = [ROW_DICT, ROW_COMPACT]
+
+
+def new_column(values):
+    '''
+    Build a typed column from a sequence of integer values
+    '''
+    if numpy is not None:
+        return numpy.asarray(values, dtype=numpy.uint8)
+    return array(TYPE_CODE, values)
+
+
+def column_to_list(column):
+    '''
+    Return column values as a list of python integers
+    '''
+    # NumPy arrays, typed arrays and memory views all provide tolist()
+    if hasattr(column, 'tolist'):
+        return column.tolist()
+    return list(column)
+
+
+class Row(Mapping):
+    '''
+    Read-only record of a row (mapping of attribute names to values) sharing
+    the attribute positions with all rows of its table
+    '''
+
+    __slots__ = ('field_index', '_values')
+
+    def __init__(self, field_index, values):
+        # Attribute name -> position (same dictionary for all rows)
+        self.field_index = field_index
+        # Tuple of values (not named values, which is a Mapping method)
+        self._values = values
+
+    def __getitem__(self, name):
+        return self._values[self.field_index[name]]
+
+    def __iter__(self):
+        return iter(self.field_index)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return 'Row({r})'.format(r=dict(self.items()))
+
+    def copy(self):
+        '''
+        Return the row as a dictionary
+        '''
+        return dict(self.items())
+
+
+def new_row_factory(fieldnames):
+    '''
+    Return a function building compact rows of attributes from tuples
+    '''
+    field_index = {name: index for index, name in enumerate(fieldnames)}
+
+    def new_row(values):
+        return Row(field_index, values)
+
+    return new_row
+
+
+def concat_tables(table_list):
+    '''
+    Concatenate tables with the same attributes into a single table
+    '''
+    fieldnames = None
+    columns = []
+    for tab in table_list:
+        if fieldnames is None:
+            fieldnames = tab.fieldnames
+            columns = [[] for _ in fieldnames]
+        for index, column in enumerate(tab.columns):
+            columns[index].append(column)
+    if fieldnames is None:
+        return Table([], [])
+    if numpy is not None:
+        return Table(fieldnames, [numpy.concatenate(parts)
+                                  for parts in columns])
+    merged_list = []
+    for parts in columns:
+        merged = array(TYPE_CODE)
+        for part in parts:
+            merged.extend(part)
+        merged_list.append(merged)
+    return Table(fieldnames, merged_list)
+
+
+class Table:
+    '''
+    Table of integer attributes stored as one typed array per attribute
+    '''
+
+    def __init__(self, fieldnames, columns):
+        # Attribute names in table order
+        self.fieldnames = list(fieldnames)
+        # Typed arrays, one for each attribute
+        self.columns = list(columns)
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def column(self, name):
+        '''
+        Return the column of an attribute
+        '''
+        return self.columns[self.fieldnames.index(name)]
+
+    def take(self, index_list):
+        '''
+        Return a table with the rows at a list of positions
+        '''
+        if numpy is not None:
+            index_array = numpy.asarray(index_list, dtype=numpy.int64)
+            return Table(self.fieldnames,
+                         [numpy.asarray(column)[index_array]
+                          for column in self.columns])
+        # Columns keep their type code (memory views use the default one)
+        return Table(self.fieldnames,
+                     [array(getattr(column, 'typecode', TYPE_CODE),
+                            [column[index] for index in index_list])
+                      for column in self.columns])
+
+    def rows(self, fieldnames=None):
+        '''
+        Iterate over table rows as tuples of integers
+        '''
+        if fieldnames is None:
+            fieldnames = self.fieldnames
+        return zip(*[column_to_list(self.column(name))
+                     for name in fieldnames])
+
+    def records(self):
+        '''
+        Iterate over table rows as dictionaries
+        '''
+        for row in self.rows():
+            yield dict(zip(self.fieldnames, row))
+
+    def row_views(self):
+        '''
+        Iterate over table rows as compact rows
+        '''
+        return map(new_row_factory(self.fieldnames), self.rows())